@@ -0,0 +1,45 @@
+"""
+複数口座（サブアカウント含む）の設定読み込み
+- config.json に "accounts" があれば全口座を読み込む
+- 無ければ従来通り api_key / api_secret の1口座のみ
+- 口座ごとに状態ファイルを分ける
+"""
+
+import json
+from pathlib import Path
+
+config_path = Path(__file__).parent.parent / 'config' / 'config.json'
+DEFAULT_ACCOUNT = 'main'
+
+def load_accounts():
+    """口座一覧を読み込み
+
+    config.json の形式:
+        {"api_key": "...", "api_secret": "..."}                      # 従来（1口座）
+        {"accounts": [{"name": "main", "api_key": "...", "api_secret": "..."}, ...]}
+    """
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    if 'accounts' not in config:
+        return [{'name': DEFAULT_ACCOUNT, 'apis': {"bybit": [config['api_key'], config['api_secret']]}}]
+
+    accounts = []
+    for account in config['accounts']:
+        accounts.append({
+            'name': account['name'],
+            'apis': {"bybit": [account['api_key'], account['api_secret']]},
+        })
+
+    names = [account['name'] for account in accounts]
+    if len(names) != len(set(names)):
+        raise ValueError(f"config.json の口座名が重複しています: {names}")
+
+    return accounts
+
+def account_file(file_name, account_name):
+    """口座ごとの状態ファイル名（main口座は従来のファイル名のまま）"""
+    if account_name == DEFAULT_ACCOUNT:
+        return file_name
+    path = Path(file_name)
+    return str(path.with_name(f"{path.stem}_{account_name}{path.suffix}"))
@@ -1,10 +1,45 @@
-import requests
+import json
+import os
+import time
+import uuid
 from datetime import datetime
+from pathlib import Path
 
 webhook_url = "https://discord.com/api/webhooks/1369503632650928148/lNMN5RzSRDTIYo2X4nTbMBlv4Rzg_HYR4PQY7shMnTnAhZv-xkbdVAdbI59JAslVa8cl"
 webhook_url2 = "https://discord.com/api/webhooks/1392043445182398564/eeAtT9WHF3EYSurQn5k0DrGnHDt0TZxse3xZOjbT7quzN6du0aK2229JCipPTTKjK3ei"
 webhook_url3 = "https://discord.com/api/webhooks/1394107484255555758/ZsB2rnwxXLOrv9kwZOc6yB8jl11lbZNNGs90apR3w6_EnwmqTyYuFst4Bgw4SnTrrVDS"
 
+# 通知サービス（notify_service.py）のスプール
+SPOOL_DIR = Path('notify_spool')
+SERVICE_ALIVE_FILE = SPOOL_DIR / 'service.alive'
+SERVICE_TIMEOUT = 30  # 秒。これより長く生存確認が無ければサービス停止とみなして直接送信
+
+def _post(url, **kwargs):
+    import requests  # cronの何もしない起動で読み込まないよう遅延
+    return requests.post(url, **kwargs)
+
+def service_running():
+    """通知サービスが動いているか（生存確認ファイルの更新時刻で判定）"""
+    try:
+        return time.time() - os.path.getmtime(SERVICE_ALIVE_FILE) < SERVICE_TIMEOUT
+    except OSError:
+        return False
+
+def enqueue(kind, **fields):
+    """イベントをスプールに書き込む。サービスが止まっていれば False（呼び出し側で直接送信）"""
+    if not service_running():
+        return False
+    event = {'kind': kind, 'time': time.time(), **fields}
+    name = f"{time.time_ns()}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    tmp_path = SPOOL_DIR / f"{name}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(event, f, ensure_ascii=False)
+        os.replace(tmp_path, SPOOL_DIR / f"{name}.event")  # 書き込み途中のファイルはサービスから見えない
+        return True
+    except OSError:
+        return False
+
 def entry_discord(result=None, symbol=None, qty=None, entry_price=None, take_profit=None, direction=None):
     now = datetime.now()
     color = 0x55efc4 if direction == "LONG" else 0xff7675  # 緑 or 赤
@@ -31,7 +66,7 @@ def entry_discord(result=None, symbol=None, qty=None, entry_price=None, take_pro
     }
 
     payload = {"embeds": [embed]}
-    response = requests.post(webhook_url2, json=payload)
+    response = _post(webhook_url2, json=payload)
     if response.status_code == 204:
         print("✅ Discord通知成功！")
     else:
@@ -55,14 +90,20 @@ def notify_discord(symbol=None, qty=None, entry_price=None, exit_price=None):
     }
 
     payload = {"embeds": [embed]}
-    response = requests.post(webhook_url2, json=payload)
+    response = _post(webhook_url2, json=payload)
     if response.status_code == 204:
         print("✅ Discord通知成功！")
     else:
         print(f"⚠️ Discord通知失敗: {response.status_code} - {response.text}")
 
-def notify_error_discord(subtitle=None, error_message=None):
-    now = datetime.now()
+def notify_error_discord(subtitle=None, error_message=None, critical=False):
+    """エラー通知。通知サービスが動いていれば重複をまとめて送信、critical は常に即時送信"""
+    if not critical and enqueue('error', subtitle=subtitle, error_message=error_message):
+        return
+    send_error_discord(subtitle, error_message)
+
+def send_error_discord(subtitle=None, error_message=None, now=None):
+    now = now or datetime.now()
     embed = {
         "title": "🚨 エラー通知",
         "description": f"```{subtitle}{error_message}```",
@@ -73,28 +114,70 @@ def notify_error_discord(subtitle=None, error_message=None):
         "footer": {"text": "powered by YOURBOT"},
     }
     payload = {"embeds": [embed]}
-    res = requests.post(webhook_url3, json=payload)
+    res = _post(webhook_url3, json=payload)
     if res.status_code == 204:
         print("✅ エラーDiscord通知成功")
+        return True
     else:
         print(f"⚠️ エラーDiscord通知失敗: {res.status_code} - {res.text}")
+        return False
 
 def notify_dual_discord(msg):
+    """動作確認（ハートビート）通知。通知サービスが動いていれば集計して定期ダイジェストにまとめる"""
+    if enqueue('heartbeat', msg=msg):
+        return
+    send_dual_discord(msg)
+
+def send_dual_discord(msg, fields=None):
     now = datetime.now()
     embed = {
         "title": msg,
         "color": 0xe17055,
-        "fields": [
+        "fields": (fields or []) + [
             {"name": "通知時刻", "value": f"`{now.strftime('%Y-%m-%d %H:%M:%S')}`", "inline": False}
         ],
         "footer": {"text": "powered by YOURBOT"},
     }
     payload = {"embeds": [embed]}
-    res = requests.post(webhook_url, json=payload)
+    res = _post(webhook_url, json=payload)
     if res.status_code == 204:
         print("処理通知完了")
+        return True
     else:
         print(f"⚠️ エラーDiscord通知失敗: {res.status_code} - {res.text}")
+        return False
+
+def smoke_test():
+    """requests を差し替えて、各送信関数が webhook まで到達するか確認（実際には送信しない）"""
+    import sys
+    import types
+
+    posted = []
+    class Response:
+        status_code = 204
+        text = ''
+    stub = types.ModuleType('requests')
+    stub.post = lambda url, **kwargs: posted.append((url, kwargs['json'])) or Response()
+    original = sys.modules.get('requests')
+    sys.modules['requests'] = stub
+    try:
+        entry_discord(result="OK", symbol="BTCUSDT", qty=0.02, entry_price=60000, take_profit=61000, direction="LONG")
+        notify_discord(symbol="BTCUSDT", qty=0.02, entry_price=60000, exit_price=61000)
+        assert send_error_discord("smoke", "test") is True
+        assert send_dual_discord("smoke", [{"name": "a", "value": "b", "inline": False}]) is True
+    finally:
+        if original is not None:
+            sys.modules['requests'] = original
+        else:
+            del sys.modules['requests']
+
+    assert [url for url, _ in posted] == [webhook_url2, webhook_url2, webhook_url3, webhook_url], posted
+    assert all(payload['embeds'] for _, payload in posted)
+    print(f"✅ 通知スモークテスト成功（{len(posted)}件）")
 
 if __name__ == '__main__':
-    notify_dual_discord(msg="test")
\ No newline at end of file
+    import sys
+    if '--smoke' in sys.argv:
+        smoke_test()
+    else:
+        notify_dual_discord(msg="test")
\ No newline at end of file
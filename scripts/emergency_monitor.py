@@ -7,13 +7,20 @@
 
 import asyncio
 import sys
-from pathlib import Path
 import json
+import math
 import os
 import traceback
 from datetime import datetime
-import pybotters
 from discord import notify_error_discord, notify_discord, notify_dual_discord
+from accounts import load_accounts, account_file, DEFAULT_ACCOUNT
+from emergency_settings import MAX_LOSS_PERCENTAGE, BALANCE_UPDATE_HOURS, INITIAL_BALANCE
+from fast_start import LazyClient
+from profiling import profiled_run, PROFILE_FLAG
+from market_bus import read_positions, read_wallet_balance, read_mark_prices
+from execution_tracker import ExecutionTracker, execution_file
+import trade_journal
+from trade_journal import journal_file
 
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -21,16 +28,9 @@ if sys.platform.startswith('win'):
 # ===========================================
 # 設定
 # ===========================================
-MAX_LOSS_PERCENTAGE = 0.7      # 50%損失で緊急停止
-BALANCE_UPDATE_HOURS = 24       # 24時間ごとに基準残高を自動更新
-INITIAL_BALANCE = 30.0       # 初期値（初回のみ使用）
-
-# ファイル設定
-config_path = Path(__file__).parent.parent / 'config' / 'config.json'
-with open(config_path, encoding='utf-8') as f:
-    config = json.load(f)
-
-apis = {"bybit": [config['api_key'], config['api_secret']]}
+# 損失率・基準残高の更新間隔・初期値は emergency_settings.py
+# ファイル設定（口座ごとに account_file で分離）
+accounts = load_accounts()
 base_url = 'https://api.bybit.com'
 position_file = 'position_status.json'
 balance_file = 'balance_reference.json'
@@ -38,7 +38,7 @@ balance_file = 'balance_reference.json'
 # ===========================================
 # 基準残高管理
 # ===========================================
-def load_reference_balance():
+def load_reference_balance(balance_file=balance_file):
     """基準残高を読み込み"""
     if os.path.exists(balance_file):
         with open(balance_file, 'r') as f:
@@ -46,10 +46,10 @@ def load_reference_balance():
             return data['reference_balance'], data['last_update']
     
     # 初回作成
-    save_reference_balance(INITIAL_BALANCE)
+    save_reference_balance(INITIAL_BALANCE, balance_file)
     return INITIAL_BALANCE, datetime.now().isoformat()
 
-def save_reference_balance(balance):
+def save_reference_balance(balance, balance_file=balance_file):
     """基準残高を保存"""
     data = {
         'reference_balance': balance,
@@ -67,8 +67,12 @@ def should_update_balance(last_update_str):
 # ===========================================
 # API関数
 # ===========================================
-async def get_account_balance(client):
-    """統合取引アカウントの資産情報取得"""
+async def get_account_balance(client, account_name=DEFAULT_ACCOUNT):
+    """統合取引アカウントの資産情報取得（マーケットデータバスが動いていればそちらから）"""
+    bus_balance = read_wallet_balance(account_name)
+    if bus_balance is not None:
+        return bus_balance
+
     try:
         params = {"accountType": "UNIFIED"}
         endpoint = "/v5/account/wallet-balance"
@@ -93,8 +97,17 @@ async def get_account_balance(client):
         print(f"❌ 残高取得エラー: {str(e)}")
         return None
 
-async def get_all_positions_pnl(client):
-    """全ポジションの未実現PnLを取得"""
+async def get_all_positions_pnl(client, account_name=DEFAULT_ACCOUNT, use_bus=True):
+    """全ポジションの未実現PnLを取得（use_bus ならマーケットデータバスから。数秒遅れることがあるので監視用）"""
+    bus_positions = read_positions(account_name) if use_bus else None
+    if bus_positions is not None:
+        marks = read_mark_prices() or {}
+        position_details = [
+            {'symbol': pos['symbol'], 'pnl': pos['unrealisedPnl'], 'side': pos['side'], 'size': pos['size'], 'mark_price': marks.get(pos['symbol']), 'avg_price': pos['avgPrice']}
+            for pos in bus_positions
+        ]
+        return sum(p['pnl'] for p in position_details), position_details
+
     try:
         endpoint = "/v5/position/list"
         url = f"{base_url}{endpoint}"
@@ -130,7 +143,9 @@ async def get_all_positions_pnl(client):
                     'symbol': symbol,
                     'pnl': pnl,
                     'side': pos.get('side'),
-                    'size': size
+                    'size': size,
+                    'mark_price': float(pos.get('markPrice') or 'nan'),
+                    'avg_price': float(pos.get('avgPrice') or 'nan')
                 })
         
         return total_pnl, position_details
@@ -139,10 +154,8 @@ async def get_all_positions_pnl(client):
         print(f"❌ ポジションPnL取得エラー: {str(e)}")
         return 0.0, []
 
-async def emergency_close_position(client, symbol, side, qty):
+async def emergency_close_position(client, tracker, symbol, side, qty, mark_price=None):
     """個別ポジションを緊急クローズ"""
-    url = f"{base_url}/v5/order/create"
-    
     for attempt in range(3):
         try:
             close_side = "Sell" if side == "Buy" else "Buy"
@@ -156,7 +169,7 @@ async def emergency_close_position(client, symbol, side, qty):
                 'reduceOnly': True
             }
             
-            response = await client.fetch("POST", url=url, data=params)
+            response = await tracker.send_order(client, params, purpose='emergency', expected_price=mark_price)
             
             if response.status == 200:
                 data = json.loads(response.text)
@@ -177,28 +190,31 @@ async def emergency_close_position(client, symbol, side, qty):
 # ===========================================
 # メイン監視ロジック
 # ===========================================
-async def check_emergency_stop():
-    """緊急ストップチェック"""
+async def check_emergency_stop(account):
+    """緊急ストップチェック（口座ごと）"""
+    name = account['name']
+    account_balance_file = account_file(balance_file, name)
     
-    async with pybotters.Client(apis=apis) as client:
+    # マーケットデータバスから残高・建玉が読めれば pybotters は読み込まない
+    async with LazyClient(apis=account['apis']) as client:
         
         # 1. 現在の残高取得
-        current_balance = await get_account_balance(client)
+        current_balance = await get_account_balance(client, name)
         if current_balance is None:
-            print("⚠️ 残高取得失敗")
+            print(f"⚠️ [{name}] 残高取得失敗")
             return False
         
         # 2. 基準残高の管理
-        reference_balance, last_update = load_reference_balance()
+        reference_balance, last_update = load_reference_balance(account_balance_file)
         
         # 3. 自動更新チェック
         if should_update_balance(last_update):
-            print(f"📊 基準残高自動更新: {reference_balance:.2f} → {current_balance:.2f} USDT")
+            print(f"📊 [{name}] 基準残高自動更新: {reference_balance:.2f} → {current_balance:.2f} USDT")
             reference_balance = current_balance
-            save_reference_balance(reference_balance)
+            save_reference_balance(reference_balance, account_balance_file)
         
         # 4. 全ポジションのPnL取得
-        total_pnl, position_details = await get_all_positions_pnl(client)
+        total_pnl, position_details = await get_all_positions_pnl(client, name)
         
         # 5. 損失計算
         total_equity = current_balance + total_pnl
@@ -206,7 +222,7 @@ async def check_emergency_stop():
         loss_percentage = total_loss / reference_balance if reference_balance > 0 else 0
         
         # 6. ログ出力
-        print(f"📊 基準残高: {reference_balance:.2f} USDT")
+        print(f"📊 [{name}] 基準残高: {reference_balance:.2f} USDT")
         print(f"📊 現在残高: {current_balance:.2f} USDT")
         print(f"📊 未実現PnL: {total_pnl:.2f} USDT")
         print(f"📊 総資産: {total_equity:.2f} USDT")
@@ -214,39 +230,54 @@ async def check_emergency_stop():
         
         # 7. 緊急ストップ判定
         if loss_percentage >= MAX_LOSS_PERCENTAGE:
-            print(f"🚨 緊急ストップ発動！損失率: {loss_percentage:.1%}")
+            print(f"🚨 [{name}] 緊急ストップ発動！損失率: {loss_percentage:.1%}")
             
-            # Discord通知
+            # Discord通知（通知に失敗してもクローズは必ず実行）
             pnl_summary = "\n".join([f"{p['symbol']}: {p['pnl']:.2f} USDT" for p in position_details])
-            notify_error_discord(
-                subtitle="🚨 緊急ストップ発動",
-                error_message=f"基準残高: {reference_balance:.0f} USDT\n現在残高: {current_balance:.2f} USDT\n総資産: {total_equity:.2f} USDT\n損失率: {loss_percentage:.1%}\n\n{pnl_summary}"
-            )
+            try:
+                notify_error_discord(
+                    subtitle=f"🚨 [{name}] 緊急ストップ発動",
+                    error_message=f"基準残高: {reference_balance:.0f} USDT\n現在残高: {current_balance:.2f} USDT\n総資産: {total_equity:.2f} USDT\n損失率: {loss_percentage:.1%}\n\n{pnl_summary}",
+                    critical=True
+                )
+            except Exception as e:
+                print(f"❌ [{name}] 緊急ストップ通知エラー: {str(e)}")
             
-            # 8. 全ポジション強制クローズ
-            await execute_emergency_close(client, position_details)
+            # 8. 全ポジション強制クローズ（数量はバスではなくRESTで取り直した建玉を使う）
+            _, position_details = await get_all_positions_pnl(client, name, use_bus=False)
+            tracker = ExecutionTracker(account_file(execution_file, name))
+            await execute_emergency_close(client, position_details, account_file(position_file, name), tracker, account_file(journal_file, name))
             
             return True
         
         return False
 
-async def execute_emergency_close(client, position_details):
+async def execute_emergency_close(client, position_details, position_file=position_file, tracker=None, journal_path=journal_file):
     """全ポジションを緊急クローズ"""
     
     if not position_details:
         return
     
     print(f"🚨 {len(position_details)}個のポジションを緊急クローズします")
+    tracker = tracker or ExecutionTracker()
     
     success_count = 0
     failed_symbols = []
+    # ジャーナル用に、クローズで消える前のエントリー時刻を控えておく
+    local_positions = {}
+    if os.path.exists(position_file):
+        try:
+            with open(position_file, 'r') as f:
+                local_positions = json.load(f)
+        except Exception:
+            pass
     
     for pos in position_details:
         symbol = pos['symbol']
         side = pos['side']
         size = pos['size']
         
-        success = await emergency_close_position(client, symbol, side, size)
+        success = await emergency_close_position(client, tracker, symbol, side, size, pos.get('mark_price'))
         
         if success:
             success_count += 1
@@ -281,57 +312,94 @@ async def execute_emergency_close(client, position_details):
     if failed_symbols:
         notify_error_discord(
             subtitle="🚨 緊急クローズ一部失敗",
-            error_message=f"成功: {success_count}件\n失敗: {', '.join(failed_symbols)}"
+            error_message=f"成功: {success_count}件\n失敗: {', '.join(failed_symbols)}",
+            critical=True
         )
+    
+    # 約定結果とトレードを記録（約定の取得待ちでクローズや通知を遅らせないよう最後に行う）
+    try:
+        fills = {record['symbol'].decode(): record for record in (await tracker.flush(client)).values() if record['ret_code'] == 0}
+        record_emergency_trades(position_details, failed_symbols, fills, local_positions, journal_path)
+    except Exception as e:
+        print(f"⚠️ 約定記録エラー: {str(e)}")
+
+def record_emergency_trades(position_details, failed_symbols, fills, local_positions, journal_path):
+    """緊急クローズしたポジションをトレードジャーナルに追記"""
+    for pos in position_details:
+        symbol = pos['symbol']
+        if symbol in failed_symbols:
+            continue
+        fill = fills.get(symbol)
+        exit_price = float(fill['fill_price']) if fill is not None else float('nan')
+        if math.isnan(exit_price):
+            exit_price = pos.get('mark_price') or float('nan')
+        if symbol in local_positions:
+            position_info = dict(local_positions[symbol], qty=pos['size'])
+            position_info.setdefault('entry_price', pos.get('avg_price'))
+            trade_journal.record_close_from_position(symbol, position_info, 'emergency', exit_price, path=journal_path)
+        else:
+            # bot 以外で建てたポジションはエントリー時刻不明
+            trade_journal.record_close(
+                symbol, 1 if pos['side'] == 'Buy' else -1, 'emergency', pos['size'],
+                pos.get('avg_price') or float('nan'), 0, exit_price, path=journal_path,
+            )
 
 # ===========================================
 # 手動機能（最低限）
 # ===========================================
-def reset_balance(new_balance):
+def reset_balance(new_balance, account_name=DEFAULT_ACCOUNT):
     """手動で基準残高をリセット"""
-    save_reference_balance(new_balance)
-    print(f"✅ 基準残高を {new_balance:.2f} USDT にリセットしました")
+    save_reference_balance(new_balance, account_file(balance_file, account_name))
+    print(f"✅ [{account_name}] 基準残高を {new_balance:.2f} USDT にリセットしました")
 
-def show_status():
+def show_status(account_name=DEFAULT_ACCOUNT):
     """現在の状態を表示"""
-    reference_balance, last_update = load_reference_balance()
+    reference_balance, last_update = load_reference_balance(account_file(balance_file, account_name))
     update_time = datetime.fromisoformat(last_update)
     hours_since_update = (datetime.now() - update_time).total_seconds() / 3600
     
-    print(f"📊 基準残高: {reference_balance:.2f} USDT")
+    print(f"📊 [{account_name}] 基準残高: {reference_balance:.2f} USDT")
     print(f"📊 最終更新: {update_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"📊 更新から: {hours_since_update:.1f}時間経過")
-    print(f"📊 次回更新まで: {24 - hours_since_update:.1f}時間")
+    print(f"📊 次回更新まで: {BALANCE_UPDATE_HOURS - hours_since_update:.1f}時間")
 
 # ===========================================
 # メイン実行
 # ===========================================
-async def main():
-    """メイン実行関数"""
+async def monitor_account(account):
+    """口座ごとの緊急監視"""
+    name = account['name']
     try:
-        print(f"🔍 緊急監視開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"🔍 [{name}] 緊急監視開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
-        emergency_triggered = await check_emergency_stop()
+        emergency_triggered = await check_emergency_stop(account)
         
         if emergency_triggered:
-            print("🚨 緊急ストップが実行されました")
+            print(f"🚨 [{name}] 緊急ストップが実行されました")
         else:
-            print("✅ 正常範囲内です")
-            notify_dual_discord(msg = "✅ 緊急監視処理完了")
+            print(f"✅ [{name}] 正常範囲内です")
+            notify_dual_discord(msg = f"✅ [{name}] 緊急監視処理完了")
     except Exception as e:
         error_msg = traceback.format_exc()
-        print(f"❌ 緊急監視エラー: {str(e)}")
+        print(f"❌ [{name}] 緊急監視エラー: {str(e)}")
         notify_error_discord(
-            subtitle="緊急監視システムエラー",
+            subtitle=f"[{name}] 緊急監視システムエラー",
             error_message=error_msg
         )
 
+async def main():
+    """メイン実行関数"""
+    # 口座ごとに独立して判定（1口座の失敗が他口座の監視を止めない）
+    await asyncio.gather(*(monitor_account(account) for account in accounts))
+
 if __name__ == "__main__":
-    # コマンドライン引数で手動機能を実行
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "reset" and len(sys.argv) > 2:
-            reset_balance(float(sys.argv[2]))
-        elif sys.argv[1] == "status":
-            show_status()
+    # コマンドライン引数で手動機能を実行（--profile は除外）
+    args = [arg for arg in sys.argv[1:] if arg != PROFILE_FLAG]
+    if args:
+        # reset <残高> [口座名] / status [口座名]
+        if args[0] == "reset" and len(args) > 1:
+            reset_balance(float(args[1]), *args[2:3])
+        elif args[0] == "status":
+            show_status(*args[1:2])
     else:
-        asyncio.run(main())
\ No newline at end of file
+        profiled_run(main())
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""
+緊急ストップの設定値
+- emergency_monitor.py と emergency_simulator.py で共有（口座設定を読まないので import だけで副作用なし）
+"""
+
+MAX_LOSS_PERCENTAGE = 0.7      # 70%損失で緊急停止
+BALANCE_UPDATE_HOURS = 24       # 24時間ごとに基準残高を自動更新
+INITIAL_BALANCE = 30.0       # 初期値（初回のみ使用）
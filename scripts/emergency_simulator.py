@@ -0,0 +1,194 @@
+"""
+緊急ストップ閾値のモンテカルロシミュレーター
+- 過去のローソク足（またはトレード損益率）をブートストラップして資産推移を大量生成
+- emergency_monitor.py と同じルール（基準残高の定期更新・損失率での停止）を全パスに一括適用
+- 基準残高は確定残高（walletBalance）で更新し、停止判定は未実現損益込みの総資産で行う
+- 停止頻度・見逃したドローダウン（監視間隔・基準残高の更新待ちによるもの）・停止後の回復を集計
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import numpy as np
+import pybotters
+from emergency_settings import MAX_LOSS_PERCENTAGE, BALANCE_UPDATE_HOURS, INITIAL_BALANCE
+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+base_url = 'https://api.bybit.com'
+
+# ===========================================
+# 元データ
+# ===========================================
+async def fetch_returns(symbol, interval, pages=5):
+    """ローソク足の終値から1本ごとの騰落率を取得（1000本×pages、古い順）"""
+    closes = {}
+    end = None
+    async with pybotters.Client() as client:
+        for _ in range(pages):
+            params = {'category': "linear", 'symbol': symbol, 'interval': interval, 'limit': "1000"}
+            if end is not None:
+                params['end'] = str(end)
+            res = await client.fetch("GET", url=f"{base_url}/v5/market/kline", params=params)
+            rows = json.loads(res.text).get('result', {}).get('list', [])
+            if not rows:
+                break
+            for row in rows:
+                closes[int(row[0])] = float(row[4])
+            end = min(int(row[0]) for row in rows) - 1
+
+    prices = np.array([closes[ts] for ts in sorted(closes)])
+    return prices[1:] / prices[:-1] - 1
+
+def load_trade_returns(path):
+    """トレードごとの損益率（資産に対する割合）を1行1件で読み込み"""
+    return np.loadtxt(path, dtype=np.float64, ndmin=1)
+
+# ===========================================
+# パス生成
+# ===========================================
+def bootstrap_paths(returns, n_paths, n_steps, block=24, exposure=1.0, seed=None):
+    """騰落率をブロックブートストラップして資産推移（初期値1）を生成"""
+    rng = np.random.default_rng(seed)
+    block = min(block, len(returns))
+    n_blocks = math.ceil(n_steps / block)
+    starts = rng.integers(0, len(returns) - block + 1, size=(n_paths, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :n_steps]
+    step_returns = np.maximum(returns[idx] * exposure, -1.0)  # 証拠金以上は失わない
+    return np.hstack([np.ones((n_paths, 1)), np.cumprod(1 + step_returns, axis=1)])
+
+def realized_balance(equity, hold_steps):
+    """hold_steps ごとにポジションを決済して建て直すとみなした確定残高（walletBalance 相当、未実現損益を含まない）"""
+    steps = np.arange(equity.shape[1])
+    return equity[:, steps // hold_steps * hold_steps]
+
+def trade_paths(trade_returns, n_paths, n_steps, trade_prob, seed=None):
+    """各ステップで確率 trade_prob でトレードが決済される資産推移（初期値1）を生成"""
+    rng = np.random.default_rng(seed)
+    sampled = rng.choice(trade_returns, size=(n_paths, n_steps))
+    step_returns = np.where(rng.random((n_paths, n_steps)) < trade_prob, np.maximum(sampled, -1.0), 0.0)
+    return np.hstack([np.ones((n_paths, 1)), np.cumprod(1 + step_returns, axis=1)])
+
+# ===========================================
+# ルール適用
+# ===========================================
+def simulate(equity, steps_per_hour, max_loss=MAX_LOSS_PERCENTAGE, update_hours=BALANCE_UPDATE_HOURS, check_every=1, wallet=None):
+    """check_emergency_stop / should_update_balance と同じ判定を全パスに一括適用
+
+    equity は総資産（確定残高 + 未実現損益）、wallet は確定残高（walletBalance）。
+    wallet を省略すると損益はすべて確定済みとみなす（トレード損益率から作ったパス）。
+    監視は check_every ステップごと。各監視時に
+      1. 前回更新から update_hours 以上経過していれば基準残高 = その時点の確定残高（未実現損益は含まない）
+      2. (基準残高 - 総資産) / 基準残高 >= max_loss なら停止
+    """
+    wallet = equity if wallet is None else wallet
+    n_paths, n_total = equity.shape
+    steps = np.arange(n_total)
+    checks = steps[::check_every]
+    # 監視間隔は一定なので、基準残高の更新タイミングは全パス共通
+    update_period = max(math.ceil(update_hours * steps_per_hour / check_every), 1)
+    ref_steps = checks[(np.arange(len(checks)) // update_period) * update_period]
+
+    ref_at_check = wallet[:, ref_steps]
+    loss_at_check = np.maximum(0, 1 - equity[:, checks] / ref_at_check)
+    hit = loss_at_check >= max_loss
+    stopped = hit.any(axis=1)
+    stop_check = np.where(stopped, hit.argmax(axis=1), len(checks) - 1)
+    stop_step = checks[stop_check]
+    rows = np.arange(n_paths)
+
+    # 見逃し: 監視の合間に閾値を割ったもの、または基準残高の更新待ちの間に増えた確定残高から閾値以上減ったもの
+    # （毎ステップ直前の確定残高を基準に監視していれば、実際より早く、または停止しなかったパスでも止まっていた）
+    ref_every_step = wallet[:, np.repeat(ref_steps, check_every)[:n_total]]
+    prev_wallet = np.hstack([wallet[:, :1], wallet[:, :-1]])
+    loss_every_step = np.maximum(0, 1 - equity / np.maximum(ref_every_step, prev_wallet))
+    before_stop = steps[None, :] <= stop_step[:, None]
+    not_yet_stopped = ~stopped[:, None] | (steps[None, :] < stop_step[:, None])
+    missed = ((loss_every_step >= max_loss) & not_yet_stopped).any(axis=1)
+
+    # 停止しなかったパスの最大ドローダウン（高値からの下落率）
+    drawdown = 1 - equity / np.maximum.accumulate(equity, axis=1)
+    max_drawdown = np.where(before_stop, drawdown, 0).max(axis=1)
+
+    # 停止したパスが、止めずに持ち続けていたら基準残高まで戻ったか
+    ref_at_stop = ref_at_check[rows, stop_check]
+    after_stop = steps[None, :] > stop_step[:, None]
+    recovered_mask = after_stop & (equity >= ref_at_stop[:, None])
+    recovered = stopped & recovered_mask.any(axis=1)
+    recovery_hours = (recovered_mask.argmax(axis=1) - stop_step) / steps_per_hour
+
+    return {
+        'paths': n_paths,
+        'stop_rate': stopped.mean(),
+        'median_hours_to_stop': np.median(stop_step[stopped]) / steps_per_hour if stopped.any() else math.nan,
+        'loss_at_stop_p50': _pct(loss_at_check[rows, stop_check][stopped], 50),
+        'loss_at_stop_p95': _pct(loss_at_check[rows, stop_check][stopped], 95),
+        'missed_rate': missed.mean(),
+        'max_drawdown_unstopped_p50': _pct(max_drawdown[~stopped], 50),
+        'max_drawdown_unstopped_p95': _pct(max_drawdown[~stopped], 95),
+        'recovered_after_stop_rate': recovered[stopped].mean() if stopped.any() else math.nan,
+        'median_recovery_hours': np.median(recovery_hours[recovered]) if recovered.any() else math.nan,
+        'final_equity_with_stop': np.where(stopped, equity[rows, stop_step], equity[:, -1]).mean(),
+        'final_equity_without_stop': equity[:, -1].mean(),
+    }
+
+def _pct(values, q):
+    return np.percentile(values, q) if len(values) else math.nan
+
+def print_report(results):
+    """閾値ごとの集計を表で出力"""
+    print(f"{'損失率':>6} {'更新h':>5} | {'停止率':>6} {'停止まで(h)':>10} {'停止時損失p50/p95':>17} | "
+          f"{'見逃し率(間隔)':>7} {'未停止DD p50/p95':>16} | {'回復率':>6} {'回復(h)':>7} | {'最終(停止あり/なし)':>18}")
+    for (max_loss, update_hours), r in results:
+        print(f"{max_loss:>6.0%} {update_hours:>5g} | {r['stop_rate']:>6.1%} {r['median_hours_to_stop']:>10.1f} "
+              f"{r['loss_at_stop_p50']:>8.1%}/{r['loss_at_stop_p95']:<8.1%} | "
+              f"{r['missed_rate']:>7.1%} {r['max_drawdown_unstopped_p50']:>7.1%}/{r['max_drawdown_unstopped_p95']:<8.1%} | "
+              f"{r['recovered_after_stop_rate']:>6.1%} {r['median_recovery_hours']:>7.1f} | "
+              f"{r['final_equity_with_stop'] * INITIAL_BALANCE:>8.2f}/{r['final_equity_without_stop'] * INITIAL_BALANCE:<8.2f} USDT")
+
+def main():
+    parser = argparse.ArgumentParser(description="緊急ストップ閾値のモンテカルロシミュレーション")
+    parser.add_argument('--symbol', default='BTCUSDT')
+    parser.add_argument('--interval', default='60', help="ローソク足の分数（1ステップ）")
+    parser.add_argument('--pages', type=int, default=5, help="取得するローソク足（1000本単位）")
+    parser.add_argument('--trades', help="トレード損益率ファイル（指定時はローソク足の代わりに使用）")
+    parser.add_argument('--trade-prob', type=float, default=0.05, help="1ステップあたりの決済確率（--trades 使用時）")
+    parser.add_argument('--paths', type=int, default=5000)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--block', type=int, default=24, help="ブロックブートストラップの長さ（ステップ）")
+    parser.add_argument('--exposure', type=float, default=1.0, help="資産に対する建玉の倍率")
+    parser.add_argument('--hold-hours', type=float, default=24, help="ポジションを決済して損益が確定するまでの時間（ローソク足使用時）")
+    parser.add_argument('--check-every', type=int, default=1, help="監視間隔（ステップ）")
+    parser.add_argument('--thresholds', default=str(MAX_LOSS_PERCENTAGE), help="損失率（カンマ区切り）")
+    parser.add_argument('--update-hours', default=str(BALANCE_UPDATE_HOURS), help="基準残高の更新間隔（カンマ区切り）")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    np.seterr(divide='ignore', invalid='ignore')  # 資産が0になったパスの割り算
+
+    steps_per_hour = 60 / int(args.interval)
+    n_steps = int(args.days * 24 * steps_per_hour)
+
+    started = time.perf_counter()
+    if args.trades:
+        equity = trade_paths(load_trade_returns(args.trades), args.paths, n_steps, args.trade_prob, args.seed)
+        wallet = None  # トレード損益率は決済時に一度に反映されるので、総資産 = 確定残高
+    else:
+        returns = asyncio.run(fetch_returns(args.symbol, args.interval, args.pages))
+        print(f"📊 {args.symbol} {args.interval}分足 {len(returns)}本からブートストラップ")
+        equity = bootstrap_paths(returns, args.paths, n_steps, args.block, args.exposure, args.seed)
+        wallet = realized_balance(equity, max(int(args.hold_hours * steps_per_hour), 1))
+
+    results = []
+    for max_loss in map(float, args.thresholds.split(',')):
+        for update_hours in map(float, args.update_hours.split(',')):
+            results.append(((max_loss, update_hours), simulate(equity, steps_per_hour, max_loss, update_hours, args.check_every, wallet)))
+
+    print_report(results)
+    print(f"⏱ {args.paths}パス × {n_steps}ステップ: {time.perf_counter() - started:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,61 @@
-import traceback
-from pathlib import Path
 import sys
+from accounts import load_accounts, account_file
+from fast_start import holds_all_symbols, bar_already_processed, mark_bar_processed
+
+accounts = load_accounts()
+state_file = 'position_status.json'
+symbols = ['BTCUSDT', 'ETHUSDT', 'SUIUSDT', 'SOLUSDT']
+interval = "15" # 15分足
+
+# 処理が不要なら pandas / pandas_ta / pybotters を読み込まずに終了
+if __name__ == "__main__":
+    if holds_all_symbols(state_file, accounts, symbols):
+        print("📝 全口座で全銘柄を保有中のためスキップ")
+        sys.exit(0)
+    if bar_already_processed(interval):
+        print("📝 この足の確定は処理済みのためスキップ")
+        sys.exit(0)
+
+import traceback
+import copy
 import pybotters
 import asyncio
+import contextlib
 import os
 import json
+import time
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
 from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_DOWN, getcontext
 from discord import entry_discord, notify_error_discord, notify_dual_discord
+from warm_start import BAR_COLUMNS, IncrementalADX, dual_fractal_indices, load_snapshot, save_snapshot
+from profiling import profiled_run
+from market_bus import read_klines
+from execution_tracker import ExecutionTracker, execution_file
+import trade_journal
+from trade_journal import journal_file
 
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-config_path = Path(__file__).parent.parent / 'config' / 'config.json'
-with open(config_path, encoding='utf-8') as f:
-    config = json.load(f)
-    
-apis = {"bybit": [config['api_key'], config['api_secret']]}
 dual = []
 
 class mikeBot:
-    def __init__(self, symbol:str, client: pybotters.Client):
+    def __init__(self, symbol:str, client: pybotters.Client, state_file:str = state_file):
         self.symbol = symbol
         self.leverage = 20
         self.padx = {'BTCUSDT':24, 'ETHUSDT':22, 'SUIUSDT':28, 'SOLUSDT':21}
         self.volatility_threshold = {'BTCUSDT':1.3, 'ETHUSDT':0.7, 'SUIUSDT':1.5, 'SOLUSDT': 1.6}
         self.results = []
         self.df = pd.DataFrame()
+        self.interval = interval # 15分足
+        self.kline_limit = 500 # 500本
+        self.adx_length = 14
+        self.adx_state = None
+        self.snapshot = None
+        self.failed = False # 次のcronで再試行が必要なエラーがあったか
 
         # 注文
         self.min_lot_sizes = {
@@ -43,48 +70,150 @@ class mikeBot:
             'SUIUSDT': 0.0001,
             'SOLUSDT': 0.01,
         }
-        self.state_file = 'position_status.json'
+        self.state_file = state_file
         self.load_states()
 
         # API関連
         self.base_url = 'https://api.bybit.com'
-        self.apis = {"bybit": [config['api_key'], config['api_secret']]}
         self.client: pybotters.Client = client
+        self.tracker = ExecutionTracker()
+        self.journal_file = journal_file
+
+    def for_account(self, client: pybotters.Client, account_name: str):
+        """取得済みのローソク足・フラクタルを共有したまま、口座ごとの注文用インスタンスを作成"""
+        bot = copy.copy(self)
+        bot.client = client
+        bot.state_file = account_file(state_file, account_name)
+        bot.tracker = ExecutionTracker(account_file(execution_file, account_name))
+        bot.journal_file = account_file(journal_file, account_name)
+        bot.failed = False
+        bot.load_states()
+        return bot
+
+    async def record_fills(self):
+        """約定を取得して記録し、ポジション状態の建値を実際の約定価格に置き換えてジャーナルに追記"""
+        fills = await self.tracker.flush(self.client)
+        if not fills:
+            return
+
+        self.load_states()
+        position = self.position_states.get(self.symbol)
+        if position is None or position.get('order_id') not in fills:
+            return
+        fill = fills[position['order_id']]
+        if fill['ret_code'] != 0:
+            return
+        fill_price = float(fill['fill_price'])
+        if np.isnan(fill_price):
+            # 注文は受け付けられたが約定が確認できない（position_watcher が決済履歴で判断する）
+            print(f"⚠️ {self.symbol} 約定が確認できませんでした")
+            return
+        print(f"📝 {self.symbol} 約定価格 {fill_price}（想定 {position['entry_price']}）")
+        position['entry_price'] = fill_price
+        position['filled'] = True
+        self.save_positioninfo()
+        trade_journal.record_open(
+            self.symbol, trade_journal.direction_from_close_side(position['side']), position['qty'],
+            position['entry_price'], int(fill['send_ms']), position['order_id'], self.journal_file,
+        )
+
+    def snapshot_meta(self):
+        """スナップショットの互換性チェックに使う銘柄情報"""
+        return [self.kline_limit, self.min_lot_sizes[self.symbol], self.ticksize[self.symbol]]
+
+    async def fetch_bars(self, limit):
+        """ローソク足を取得（古い順、列は BAR_COLUMNS）。マーケットデータバスが動いていればそちらから"""
+        bars = read_klines(self.symbol, self.interval, limit)
+        if bars is not None:
+            return bars
 
-    async def get_Kline(self):
-        """ローソク足を取得し、デュアルフラクタル判定"""
         endpoint = "/v5/market/kline"
         url = f"{self.base_url}{endpoint}"
         params = {
             'category': "linear",
             'symbol': self.symbol,
-            'interval' : "15", #15分足
-            'limit' : "500" # 500本
+            'interval' : self.interval,
+            'limit' : str(limit)
         }
 
         res = await self.client.fetch("GET", url=url, params=params)
         text = res.text
         data = json.loads(text)
         data = data.get('result', {}).get('list', [])
-        self.df = pd.DataFrame(data, columns=["timestamp", "open", "high", "low", "close", "volume", "quote_volume"]).astype(float)
+        bars = np.array(data, dtype=float).reshape(-1, len(BAR_COLUMNS))
+        bars = bars[np.argsort(bars[:, 0], kind='stable')]
+        return bars[~np.isnan(bars).any(axis=1)]
+
+    async def warm_start(self, snapshot):
+        """スナップショット以降の新しい足だけ取得してADX・フラクタルを更新"""
+        old_bars = snapshot['bars']
+        interval_ms = int(self.interval) * 60 * 1000
+        # 最後の確定足を1本重ねて取得し、連続しているか確認
+        new_bars = await self.fetch_bars(snapshot['gap_bars'] + 1)
+        if (len(new_bars) < 2 or new_bars[0, 0] != old_bars[-1, 0]
+                or not np.all(np.diff(new_bars[:, 0]) == interval_ms)):
+            print(f"⚠️ {self.symbol} スナップショットと新しい足が繋がらないため全件取得")
+            return None
+        new_bars = new_bars[1:]
+
+        # 確定足だけ状態を進め、最新足（未確定）はコピーした状態で計算
+        state = snapshot['adx_state']
+        new_adx = [state.update(h, l, c) for h, l, c in new_bars[:-1, 2:5]]
+        new_adx.append(state.copy().update(*new_bars[-1, 2:5]))
+        self.adx_state = state
+
+        bars = np.vstack([old_bars, new_bars])
+        adx = np.concatenate([snapshot['adx'], new_adx])
+
+        # 前回は確定していなかった足（最後の確定足の2本前以降）だけ判定
+        new_indices = dual_fractal_indices(bars[:, 2], bars[:, 3], start=len(old_bars) - 2)
+        fractal_ms = np.concatenate([snapshot['fractal_ms'], bars[new_indices, 0].astype(np.int64)])
+
+        # 保持本数を超えた古い足は捨てる
+        bars, adx = bars[-self.kline_limit:], adx[-self.kline_limit:]
+        return bars, adx, fractal_ms[fractal_ms >= bars[0, 0]]
+
+    async def get_Kline(self):
+        """ローソク足を取得し、デュアルフラクタル判定（スナップショットがあれば新しい足だけ処理）"""
+        now_ms = int(time.time() * 1000)
+        snapshot = load_snapshot(self.symbol, self.interval, self.snapshot_meta(), self.adx_length, now_ms)
+        warm = await self.warm_start(snapshot) if snapshot is not None else None
+
+        if warm is not None:
+            bars, adx, fractal_ms = warm
+        else:
+            bars = await self.fetch_bars(self.kline_limit)
+            adx = None
+
+        self.df = pd.DataFrame(bars, columns=BAR_COLUMNS)
         self.df["timestamp"] = pd.to_datetime(self.df["timestamp"].astype("int64"), unit='ms', utc=True) + pd.Timedelta(hours=9)
-        self.df = self.df.sort_values("timestamp").reset_index(drop=True).dropna()
         
         if self.df.empty: # データがうまく取得できていない場合スキップ
             notify_error_discord(subtitle="ローソク足データが空！",error_message=f"{self.symbol}のデータ取得失敗")
+            self.failed = True
             return
+
+        if adx is None:
+            # ADXの計算とNoneチェック
+            adx_result = ta.adx(self.df["high"], self.df["low"], self.df["close"], length=self.adx_length)
+            if adx_result is None or f"ADX_{self.adx_length}" not in adx_result:
+                notify_error_discord(subtitle="ADX計算エラー", error_message=f"{self.symbol}: ADX計算に失敗しました")
+                self.failed = True
+                return
+            adx = adx_result[f"ADX_{self.adx_length}"].values
+
+            # 次回のウォームスタート用に確定足までのADX状態を作成
+            self.adx_state = IncrementalADX(self.adx_length)
+            for h, l, c in bars[:-1, 2:5]:
+                self.adx_state.update(h, l, c)
+            fractal_ms = bars[dual_fractal_indices(bars[:, 2], bars[:, 3]), 0].astype(np.int64)
         
-        # ADXの計算とNoneチェック
-        adx_result = ta.adx(self.df["high"], self.df["low"], self.df["close"], length=14)
-        if adx_result is None or "ADX_14" not in adx_result:
-            notify_error_discord(subtitle="ADX計算エラー", error_message=f"{self.symbol}: ADX計算に失敗しました")
-            return
-        
-        self.df["ADX"] = adx_result["ADX_14"]
+        self.df["ADX"] = adx
         
         # ADXカラムにNaNが含まれている場合のチェック
         if self.df["ADX"].isna().all():
             notify_error_discord(subtitle="ADX計算エラー", error_message=f"{self.symbol}: ADX値がすべてNaNです")
+            self.failed = True
             return
         
         # フィボナッチレベルの計算
@@ -94,17 +223,22 @@ class mikeBot:
         self.df["profit_long_1.5"] = self.df["high"] - diff * 1.5
         self.df["profit_short_1.5"] = self.df["low"] + diff * 1.5
         
-        # デュアルフラクタル検出
-        for i in range(len(self.df) - 144, len(self.df) - 2): # 144本前までのデュアルフラクタル検出
-            # インデックスの境界チェック
-            if i < 2 or i >= len(self.df) - 2:
-                continue
-                
-            is_high_fractal = all(self.df.iloc[i]['high'] > self.df.iloc[j]['high'] for j in [i - 2, i - 1, i + 1, i + 2])
-            is_low_fractal = all(self.df.iloc[i]['low'] < self.df.iloc[j]['low'] for j in [i - 2, i - 1, i + 1, i + 2])
-
-            if is_high_fractal and is_low_fractal:
+        # デュアルフラクタル（144本前まで）
+        interval_ms = int(self.interval) * 60 * 1000
+        fractal_indices = ((fractal_ms - int(bars[0, 0])) // interval_ms).astype(int)
+        for i in np.sort(fractal_indices):
+            if len(self.df) - 144 <= i < len(self.df) - 2:
                 self.results.append(self.df.iloc[i])
+
+        # スナップショット用（未確定の最新足は含めず、確定足だけで判定できたフラクタルのみ）
+        self.snapshot = (bars[:-1], adx[:-1], fractal_ms[fractal_ms <= bars[-4, 0]] if len(bars) >= 4 else fractal_ms[:0])
+
+    def dump_snapshot(self):
+        """次回起動用にスナップショットを保存"""
+        if self.snapshot is None:
+            return
+        bars, adx, fractal_ms = self.snapshot
+        save_snapshot(self.symbol, self.interval, self.snapshot_meta(), bars, adx, self.adx_state, fractal_ms)
     
     def load_states(self):
         """保存されたポジション状態を読み込み"""
@@ -129,9 +263,6 @@ class mikeBot:
         if self.symbol in self.position_states: # 対象銘柄のポジションがあればスキップ。
             return
 
-        endpoint = '/v5/order/create'
-        url = f"{self.base_url}{endpoint}"
-
         for row in self.results:
             volatility = (row['high'] - row['low']) / row['open'] * 100
             if volatility < self.volatility_threshold[self.symbol]: # 価格変動が一定以下の場合スキップ
@@ -158,21 +289,23 @@ class mikeBot:
                 
                 # 注文処理
                 try:
-                    response = await self.client.fetch("POST", url=url, data=params)
+                    response = await self.tracker.send_order(self.client, params, purpose='entry', expected_price=target_row['close'])
                     text = response.text  
                     response_json = json.loads(text)
                     result_msg = response_json.get('retMsg', 'Unknown')
                     self.position_states[self.symbol] = {
                         'qty': qty,
                         'entry_price': target_row['close'],
-                        'exit_price': profit_long,
+                        'exit_price': float(profit_long),
                         'timestamp': datetime.now().isoformat(),
-                        'side': 'Sell' # position_wather.pyでクローズする時のために逆
+                        'side': 'Sell', # position_wather.pyでクローズする時のために逆
+                        'order_id': (response_json.get('result') or {}).get('orderId'),
                     }
                     self.save_positioninfo()
                 except Exception as e:
                     error_msg = traceback.format_exc()
                     notify_error_discord(subtitle="注文処理中にエラー発生",error_message=error_msg)
+                    self.failed = True
                     break
                 
                 # Discord通知とCSVファイル作成 
@@ -191,41 +324,69 @@ class mikeBot:
                 }
                 
                 try:
-                    response = await self.client.fetch("POST", url=url, data=params)
+                    response = await self.tracker.send_order(self.client, params, purpose='entry', expected_price=target_row['close'])
                     text = response.text  
                     response_json = json.loads(text)
                     result_msg = response_json.get('retMsg', 'Unknown')
                     self.position_states[self.symbol] = {
                     'qty': qty,
                     'entry_price': target_row['close'],
-                    'exit_price': profit_short,
+                    'exit_price': float(profit_short),
                     'timestamp': datetime.now().isoformat(), # 文字列で保存
-                    'side': 'Buy' # position_wather.pyでクローズする時のために逆
+                    'side': 'Buy', # position_wather.pyでクローズする時のために逆
+                    'order_id': (response_json.get('result') or {}).get('orderId'),
                     }
                     self.save_positioninfo()
                 except Exception as e:
                     error_msg = traceback.format_exc()
                     notify_error_discord(subtitle="注文処理中にエラー発生",error_message=error_msg)
+                    self.failed = True
                     break
                 
                 entry_discord(result=result_msg, symbol=self.symbol, qty=qty, entry_price=target_row['close'], take_profit=row['profit_short_1.5'], direction="SHORT")
 
-async def run_for_symbol(symbol, client: pybotters.Client):
-    bot = mikeBot(symbol, client)
+async def run_for_symbol(symbol, market_client: pybotters.Client, account_clients):
+    """銘柄ごとの処理。全口座まで問題なく終わったら True"""
+    bot = mikeBot(symbol, market_client)
     try:
+        # ローソク足の取得とフラクタル検出は口座数に関係なく1回だけ
         await bot.get_Kline()
-        await bot.torima_entry()
-        print(symbol, "処理完了", datetime.now())
-    except Exception as e :
+        bot.dump_snapshot()
+    except Exception:
         error_msg = traceback.format_exc()
         notify_error_discord(subtitle=f"{symbol}エラー！", error_message=error_msg)
-        return
+        return False
+    if bot.failed:
+        return False
+
+    results = await asyncio.gather(*(entry_for_account(bot, account, client) for account, client in account_clients))
+    return all(results)
+
+async def entry_for_account(bot: mikeBot, account, client: pybotters.Client):
+    """口座ごとの注文処理（状態ファイルは口座ごとに分離）。注文まで問題なく終わったら True"""
+    try:
+        account_bot = bot.for_account(client, account['name'])
+        await account_bot.torima_entry()
+        await account_bot.record_fills()
+        print(bot.symbol, account['name'], "処理完了", datetime.now())
+        return not account_bot.failed
+    except Exception:
+        error_msg = traceback.format_exc()
+        notify_error_discord(subtitle=f"{bot.symbol}({account['name']})エラー！", error_message=error_msg)
+        return False
 
 async def main():
-    symbols = ['BTCUSDT', 'ETHUSDT', 'SUIUSDT', 'SOLUSDT']
-    async with pybotters.Client(apis=apis) as client:
-        await asyncio.gather(*(run_for_symbol(symbol, client) for symbol in symbols))
+    async with contextlib.AsyncExitStack() as stack:
+        market_client = await stack.enter_async_context(pybotters.Client())
+        account_clients = [
+            (account, await stack.enter_async_context(pybotters.Client(apis=account['apis'])))
+            for account in accounts
+        ]
+        results = await asyncio.gather(*(run_for_symbol(symbol, market_client, account_clients) for symbol in symbols))
+    if all(results):
+        # 失敗があった時は処理済みにせず、同じ足の間の次のcronで再試行する
+        mark_bar_processed(interval)
     notify_dual_discord(msg="✅ エントリー処理完了")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    profiled_run(main())
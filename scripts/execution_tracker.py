@@ -0,0 +1,172 @@
+"""
+注文執行の計測（レイテンシ・約定価格・スリッページ）
+- /v5/order/create（と create-batch）の送信時刻・応答時刻・サーバー時刻を記録
+- 実行後に /v5/execution/list で実際の約定価格・約定時刻を取得
+- 固定長レコードで executions.bin に追記（np.fromfile / np.memmap でそのまま読める）
+- python execution_tracker.py [ファイル] [日数] で銘柄ごとのレイテンシ分位点とスリッページを表示
+"""
+
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+
+base_url = 'https://api.bybit.com'
+execution_file = 'executions.bin'
+
+EXECUTION_DTYPE = np.dtype([
+    ('symbol', 'S16'),
+    ('side', 'S4'),
+    ('purpose', 'S12'),       # entry / close / emergency
+    ('order_id', 'S40'),
+    ('ret_code', 'i4'),
+    ('send_ms', 'i8'),        # 送信直前（ローカル時刻）
+    ('ack_ms', 'i8'),         # 応答受信（ローカル時刻）
+    ('server_ms', 'i8'),      # 応答の time（取引所時刻）
+    ('fill_ms', 'i8'),        # 最初の約定時刻（取引所時刻）
+    ('qty', 'f8'),
+    ('expected_price', 'f8'), # 発注判断に使った価格
+    ('fill_price', 'f8'),     # 約定の加重平均価格
+    ('fill_qty', 'f8'),
+])
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+class ExecutionTracker:
+    """注文ごとに送信・応答を記録し、flush で約定を取得してファイルに追記"""
+    def __init__(self, path=execution_file):
+        self.path = path
+        self.pending = []
+
+    def _record(self, params, purpose, expected_price, send_ms, ack_ms, server_ms, ret_code, order_id):
+        record = np.zeros((), dtype=EXECUTION_DTYPE)
+        record['symbol'] = params['symbol']
+        record['side'] = params['side']
+        record['purpose'] = purpose
+        record['order_id'] = order_id or ''
+        record['ret_code'] = ret_code
+        record['send_ms'] = send_ms
+        record['ack_ms'] = ack_ms
+        record['server_ms'] = server_ms
+        record['qty'] = float(params['qty'])
+        record['expected_price'] = math.nan if expected_price is None else float(expected_price)
+        record['fill_price'] = math.nan
+        self.pending.append(record)
+        return record
+
+    async def send_order(self, client, params, purpose, expected_price=None):
+        """/v5/order/create を送信して計測（レスポンスはそのまま返す）"""
+        send_ms = _now_ms()
+        response = await client.fetch("POST", url=f"{base_url}/v5/order/create", data=params)
+        ack_ms = _now_ms()
+        try:
+            data = json.loads(response.text)
+        except (json.JSONDecodeError, TypeError):
+            data = {}
+        self._record(
+            params, purpose, expected_price, send_ms, ack_ms,
+            int(data.get('time', 0)), int(data.get('retCode', -1)), (data.get('result') or {}).get('orderId'),
+        )
+        return response
+
+    async def send_batch(self, client, category, orders, purpose, expected_prices=None):
+        """/v5/order/create-batch を送信して注文ごとに計測（レスポンスはそのまま返す）"""
+        expected_prices = expected_prices or {}
+        send_ms = _now_ms()
+        response = await client.fetch("POST", url=f"{base_url}/v5/order/create-batch", data={'category': category, 'request': orders})
+        ack_ms = _now_ms()
+        try:
+            data = json.loads(response.text)
+        except (json.JSONDecodeError, TypeError):
+            data = {}
+        results = (data.get('result') or {}).get('list', [])
+        codes = (data.get('retExtInfo') or {}).get('list', [])
+        for i, params in enumerate(orders):
+            order_id = results[i].get('orderId') if i < len(results) else None
+            ret_code = codes[i].get('code', -1) if i < len(codes) else int(data.get('retCode', -1))
+            self._record(
+                params, purpose, expected_prices.get(params['symbol']), send_ms, ack_ms,
+                int(data.get('time', 0)), int(ret_code), order_id,
+            )
+        return response
+
+    async def fetch_fill(self, client, category, order_id, retries=3):
+        """約定の加重平均価格・数量・最初の約定時刻（成行でも反映が遅れることがあるので数回確認）"""
+        for attempt in range(retries):
+            res = await client.fetch("GET", url=f"{base_url}/v5/execution/list", params={'category': category, 'orderId': order_id})
+            executions = json.loads(res.text).get('result', {}).get('list', [])
+            if executions:
+                qty = np.array([float(e['execQty']) for e in executions])
+                price = np.array([float(e['execPrice']) for e in executions])
+                return float((qty * price).sum() / qty.sum()), float(qty.sum()), min(int(e['execTime']) for e in executions)
+            if attempt < retries - 1:
+                await asyncio.sleep(0.5)
+        return None
+
+    async def flush(self, client, category="linear"):
+        """約定を取得してファイルに追記。order_id → レコード を返す"""
+        if not self.pending:
+            return {}
+        records = np.array(self.pending, dtype=EXECUTION_DTYPE)
+        self.pending = []
+
+        for record in records:
+            order_id = record['order_id'].decode()
+            if record['ret_code'] != 0 or not order_id:
+                continue
+            try:
+                fill = await self.fetch_fill(client, category, order_id)
+            except Exception as e:
+                print(f"⚠️ {order_id} 約定取得エラー: {str(e)}")
+                fill = None
+            if fill is not None:
+                record['fill_price'], record['fill_qty'], record['fill_ms'] = fill
+
+        with open(self.path, 'ab') as f:
+            records.tofile(f)
+        return {record['order_id'].decode(): record for record in records if record['order_id']}
+
+# ===========================================
+# レポート
+# ===========================================
+def load_executions(path=execution_file):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=EXECUTION_DTYPE)
+    return np.fromfile(path, dtype=EXECUTION_DTYPE)
+
+def slippage_bps(records):
+    """不利な方向をプラスとしたスリッページ（bp）"""
+    sign = np.where(records['side'] == b'Buy', 1.0, -1.0)
+    return sign * (records['fill_price'] - records['expected_price']) / records['expected_price'] * 10000
+
+def report(records):
+    """銘柄ごとのレイテンシ分位点とスリッページを表示"""
+    ok = records[records['ret_code'] == 0]
+    print(f"📊 注文 {len(records)}件（成功 {len(ok)}件）")
+    print(f"{'銘柄':<10} {'件数':>4} | {'応答ms p50/p90/p99':>20} | {'送信→約定ms p50/p90':>18} | {'スリッページbp 平均/p50/p90':>26}")
+    for symbol in np.unique(ok['symbol']):
+        rows = ok[ok['symbol'] == symbol]
+        ack = rows['ack_ms'] - rows['send_ms']
+        filled = rows[~np.isnan(rows['fill_price'])]
+        # 約定時刻は取引所時刻なので、注文ごとの時計のずれ（応答の time − 送信と受信の中間）を引いてローカル時刻に直す
+        filled_on_server = filled[filled['server_ms'] > 0]
+        offset = filled_on_server['server_ms'] - (filled_on_server['send_ms'] + filled_on_server['ack_ms']) / 2
+        fill_latency = filled_on_server['fill_ms'] - offset - filled_on_server['send_ms']
+        slip = slippage_bps(filled)
+        slip = slip[~np.isnan(slip)]
+        a50, a90, a99 = np.percentile(ack, [50, 90, 99])
+        f50, f90 = np.percentile(fill_latency, [50, 90]) if len(fill_latency) else (math.nan, math.nan)
+        s_mean, s50, s90 = (slip.mean(), *np.percentile(slip, [50, 90])) if len(slip) else (math.nan,) * 3
+        print(f"{symbol.decode():<10} {len(rows):>4} | {a50:>6.0f}/{a90:>6.0f}/{a99:>6.0f} | {f50:>8.0f}/{f90:>8.0f} | "
+              f"{s_mean:>8.1f}/{s50:>7.1f}/{s90:>7.1f}")
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else execution_file
+    records = load_executions(path)
+    if len(sys.argv) > 2:
+        records = records[records['send_ms'] >= _now_ms() - float(sys.argv[2]) * 86400 * 1000]
+    report(records)
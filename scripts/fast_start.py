@@ -0,0 +1,130 @@
+"""
+cron起動の高速化
+- pybotters / pandas / pandas_ta / numpy を読み込む前に、処理が必要かを標準ライブラリだけで判定
+  （ポジションなし・全銘柄保有中・この足の確定は処理済み）
+- 最初の通信時に pybotters.Client を作る LazyClient（マーケットデータバスから読めれば pybotters を読み込まない）
+- python fast_start.py [回数] で何もしない起動の所要時間を計測
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from accounts import account_file
+
+SNAPSHOT_DIR = Path('snapshots')  # warm_start.SNAPSHOT_DIR と同じ（numpy を読み込まないため）
+
+def _read_positions(path):
+    """状態ファイルを json だけで読む。読めない場合は None（エラー通知は本体側で行う）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            content = f.read().strip()
+        return json.loads(content) if content else {}
+    except (OSError, ValueError):
+        return None
+
+def has_local_positions(state_file, accounts):
+    """いずれかの口座の状態ファイルにポジションがあるか（読めないファイルは本体で扱うため True）"""
+    for account in accounts:
+        positions = _read_positions(account_file(state_file, account['name']))
+        if positions is None or positions:
+            return True
+    return False
+
+def holds_all_symbols(state_file, accounts, symbols):
+    """全口座が全銘柄を保有中か（新規エントリーの余地がない）"""
+    for account in accounts:
+        positions = _read_positions(account_file(state_file, account['name']))
+        if positions is None or any(symbol not in positions for symbol in symbols):
+            return False
+    return True
+
+def processed_marker(interval):
+    """entry.py が全銘柄・全口座の処理を終えた時に更新するファイル"""
+    return SNAPSHOT_DIR / f"entry_{interval}.processed"
+
+def mark_bar_processed(interval):
+    """この足の確定を処理済みにする（途中で失敗した実行では呼ばず、次のcronで再試行させる）"""
+    path = processed_marker(interval)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+def bar_already_processed(interval, now=None):
+    """処理済みマーカーが現在の足の開始以降に更新されているか（直前の足の確定はもう処理した）"""
+    interval_sec = int(interval) * 60
+    bar_start = (now if now is not None else time.time()) // interval_sec * interval_sec
+    path = processed_marker(interval)
+    return os.path.exists(path) and os.path.getmtime(path) >= bar_start
+
+class LazyClient:
+    """pybotters.Client と同じ使い方で、最初の fetch まで pybotters を読み込まない"""
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.client = None
+
+    async def fetch(self, *args, **kwargs):
+        if self.client is None:
+            import pybotters
+            self.client = pybotters.Client(**self.kwargs)
+        return await self.client.fetch(*args, **kwargs)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+# ===========================================
+# 起動時間の計測
+# ===========================================
+HEAVY_MODULES = ['pybotters', 'pandas', 'pandas_ta', 'numpy', 'requests']
+
+def _measure(args, runs, cwd=None):
+    """サブプロセスで起動して終了までの時間（ms）の中央値。失敗したら None"""
+    import statistics
+    import subprocess
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).parent))
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True)
+        if result.returncode != 0:
+            return None
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+def benchmark(runs=5):
+    """重いモジュールの読み込み時間と、各スクリプトの何もしない起動時間を表示"""
+    import tempfile  # 計測時だけ使うモジュールは cron 起動時に読み込まない
+    def show(label, ms):
+        print(f"{label:<36} {'失敗/未インストール' if ms is None else f'{ms:>8.1f}ms'}")
+
+    print(f"⏱ 起動時間（{runs}回の中央値）")
+    show("python（空の起動）", _measure(['-c', 'pass'], runs))
+    for module in HEAVY_MODULES:
+        show(f"import {module}", _measure(['-c', f'import {module}'], runs))
+
+    scripts_dir = Path(__file__).parent
+    with tempfile.TemporaryDirectory() as tmp:
+        # ポジションなし → position_watcher.py は何もせず終了
+        show("position_watcher.py（ポジションなし）", _measure([str(scripts_dir / 'position_watcher.py')], runs, tmp))
+
+        # 今の足は処理済み → entry.py は何もせず終了
+        marker = Path(tmp) / processed_marker('15')
+        marker.parent.mkdir(exist_ok=True)
+        marker.touch()
+        show("entry.py（この足は処理済み）", _measure([str(scripts_dir / 'entry.py')], runs, tmp))
+
+    for module in ['emergency_monitor', 'position_watcher', 'entry']:
+        show(f"import {module}（参考）", _measure(['-c', f'import {module}'], runs))
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
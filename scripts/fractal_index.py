@@ -0,0 +1,114 @@
+"""
+デュアルフラクタルの永続インデックス
+- 銘柄×時間足ごとに確定済みのデュアルフラクタルを npz に追記
+- フラクタルは2本後の足が確定した時点で確定
+- 再取得・再計算なしで 銘柄・時間足・期間 で検索できる
+"""
+
+import sys
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from warm_start import BAR_COLUMNS, atomic_savez, dual_fractal_indices
+
+INDEX_DIR = Path('fractal_index')
+INDEX_VERSION = 1
+TAIL_BARS = 4  # 次回の判定に必要な直近の確定足（前後2本）
+
+def interval_ms(timeframe):
+    return int(timeframe) * 60 * 1000
+
+def _to_ms(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+class FractalIndex:
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = Path(directory)
+        self._cache = {}
+
+    def _path(self, symbol, timeframe):
+        return self.directory / f"{symbol}_{timeframe}.npz"
+
+    def _load(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self._cache:
+            path = self._path(symbol, timeframe)
+            entry = {
+                'fractals': np.empty((0, len(BAR_COLUMNS))),
+                'tail': np.empty((0, len(BAR_COLUMNS))),
+            }
+            if path.exists():
+                try:
+                    with np.load(path) as data:
+                        if int(data['version']) == INDEX_VERSION:
+                            entry = {'fractals': data['fractals'], 'tail': data['tail']}
+                        else:
+                            print(f"⚠️ {symbol} {timeframe} インデックスの形式が異なるため作り直し")
+                except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                    print(f"⚠️ {symbol} {timeframe} インデックスが読めないため作り直し: {str(e)}")
+            self._cache[key] = entry
+        return self._cache[key]
+
+    def last_timestamp(self, symbol, timeframe):
+        """処理済みの最後の確定足（無ければ None）"""
+        tail = self._load(symbol, timeframe)['tail']
+        return int(tail[-1, 0]) if len(tail) else None
+
+    def update(self, symbol, timeframe, bars):
+        """確定足（古い順、列は BAR_COLUMNS）を追加し、新しく確定したフラクタルを返す"""
+        entry = self._load(symbol, timeframe)
+        tail = entry['tail']
+        last_ts = self.last_timestamp(symbol, timeframe)
+        if last_ts is not None:
+            bars = bars[bars[:, 0] > last_ts]
+        if len(bars) == 0:
+            return bars
+
+        # 前回の末尾と連続していなければ、末尾を捨てて判定し直す
+        if len(tail) and bars[0, 0] != last_ts + interval_ms(timeframe):
+            print(f"⚠️ {symbol} {timeframe} 足が連続していないため途中から再開")
+            tail = tail[:0]
+
+        combined = np.vstack([tail, bars])
+        # 前回末尾の足は、後ろ2本が揃っていなかった分だけ判定し直す
+        start = max(len(tail) - 2, 2)
+        new_fractals = combined[dual_fractal_indices(combined[:, 2], combined[:, 3], start=start)]
+
+        entry['fractals'] = np.vstack([entry['fractals'], new_fractals])
+        entry['tail'] = combined[-TAIL_BARS:]
+        atomic_savez(
+            self._path(symbol, timeframe),
+            version=np.int64(INDEX_VERSION),
+            fractals=entry['fractals'],
+            tail=entry['tail'],
+        )
+        return new_fractals
+
+    def query(self, symbol, timeframe, start=None, end=None, last=None):
+        """期間内のデュアルフラクタルを DataFrame で返す（start/end は datetime かミリ秒、last は timedelta）"""
+        fractals = self._load(symbol, timeframe)['fractals']
+        timestamps = fractals[:, 0]
+        if last is not None:
+            start = datetime.now() - last
+        lo = 0 if start is None else np.searchsorted(timestamps, _to_ms(start), side='left')
+        hi = len(fractals) if end is None else np.searchsorted(timestamps, _to_ms(end), side='right')
+        return to_frame(fractals[lo:hi], symbol, timeframe)
+
+def to_frame(fractals, symbol, timeframe):
+    """フラクタルの配列を get_dual.py と同じ形式の DataFrame に変換
+    （時刻は日本時間で表示されるが、ずらさずタイムゾーンを変換するだけなので出力ファイルでも正しい時刻になる）"""
+    df = pd.DataFrame(fractals, columns=BAR_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"].astype("int64"), unit='ms', utc=True).dt.tz_convert('Asia/Tokyo')
+    df['symbol'] = symbol
+    df['timeframe'] = timeframe
+    return df
+
+if __name__ == '__main__':
+    # python fractal_index.py SOLUSDT 60 7  → SOLUSDT 60分足の直近7日分
+    symbol, timeframe = sys.argv[1], sys.argv[2]
+    days = float(sys.argv[3]) if len(sys.argv) > 3 else 7
+    print(FractalIndex().query(symbol, timeframe, last=timedelta(days=days)))
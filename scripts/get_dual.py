@@ -2,91 +2,93 @@ import pybotters
 import numpy as np
 import pandas as pd
 import json
+import sys
+import time
 import asyncio
+from warm_start import BAR_COLUMNS
+from fractal_index import FractalIndex, interval_ms, to_frame
+from scan_writer import open_writer
+from market_bus import read_klines
+
+MAX_KLINE_LIMIT = 1000  # Bybit kline の最大取得本数
 
 class mikeneko_dual:
-    def __init__(self, symbol:str, timeframe:str, client: pybotters.Client):
+    def __init__(self, symbol:str, timeframe:str, client: pybotters.Client, index: FractalIndex):
         self.symbol = symbol
         self.timeframe = timeframe  
         self.results = []
         self.df = pd.DataFrame()
         self.client: pybotters.Client = client
+        self.index = index
         self.base_url = 'https://api.bybit.com'
+        self.limit = 300
         
     async def get_Kline(self):
-        """ローソク足を取得し、デュアルフラクタル判定"""
+        """前回以降の確定足だけ取得し、新しく確定したデュアルフラクタルをインデックスに追加"""
         endpoint = "/v5/market/kline"
         url = f"{self.base_url}{endpoint}"
-        params = {
-            'category': "linear",
-            'symbol': self.symbol,
-            'interval' : self.timeframe,
-            'limit' : "300"
-        }
 
-        res = await self.client.fetch("GET", url=url, params=params)
-        text = res.text
-        data = json.loads(text)
-        data = data.get('result', {}).get('list', [])
-        self.df = pd.DataFrame(data, columns=["timestamp", "open", "high", "low", "close", "volume", "quote_volume"]).astype(float)
-        self.df["timestamp"] = pd.to_datetime(self.df["timestamp"].astype("int64"), unit='ms', utc=True) + pd.Timedelta(hours=9)
-        self.df = self.df.sort_values("timestamp").reset_index(drop=True).dropna()
+        # インデックスが無ければ300本、あれば前回以降の足だけ（最新の未確定足を含む）
+        last_ts = self.index.last_timestamp(self.symbol, self.timeframe)
+        limit = self.limit
+        if last_ts is not None:
+            now_ms = int(time.time() * 1000)
+            limit = min(max((now_ms - last_ts) // interval_ms(self.timeframe) + 1, 2), MAX_KLINE_LIMIT)
 
-        if self.df.empty: # データがうまく取得できていない場合スキップ
-            return
-        
-        dual_fractals = {}
-        array_high = self.df['high'].values
-        array_low = self.df['low'].values
+        # マーケットデータバスが動いていればネットワークを使わない
+        bars = read_klines(self.symbol, self.timeframe, limit)
+        if bars is None:
+            params = {
+                'category': "linear",
+                'symbol': self.symbol,
+                'interval' : self.timeframe,
+                'limit' : str(limit)
+            }
 
-        high_fractals = (
-            (array_high[2:-2] > array_high[0:-4]) &
-            (array_high[2:-2] > array_high[1:-3]) &
-            (array_high[2:-2] > array_high[3:-1]) &
-            (array_high[2:-2] > array_high[4:])
-        )
+            res = await self.client.fetch("GET", url=url, params=params)
+            text = res.text
+            data = json.loads(text)
+            data = data.get('result', {}).get('list', [])
+            bars = np.array(data, dtype=float).reshape(-1, len(BAR_COLUMNS))
+            bars = bars[np.argsort(bars[:, 0], kind='stable')]
+            bars = bars[~np.isnan(bars).any(axis=1)]
 
-        low_fractals = (
-            (array_low[2:-2] < array_low[0:-4]) &
-            (array_low[2:-2] < array_low[1:-3]) &
-            (array_low[2:-2] < array_low[3:-1]) &
-            (array_low[2:-2] < array_low[4:])
-        )
-        
-        dual_fractal = high_fractals & low_fractals
-        dual_indices = np.where(dual_fractal)[0] + 2
-        duals = self.df.iloc[dual_indices]
-        dual_fractals[self.timeframe] = pd.DataFrame(duals)
-        dual_fractal = high_fractals & low_fractals
-        dual_indices = np.where(dual_fractal)[0] + 2
-        
-        if len(dual_indices) > 0:
-            duals = self.df.iloc[dual_indices].copy()
-            duals['symbol'] = self.symbol
-            duals['timeframe'] = self.timeframe
-            return duals
+        if len(bars) < 2: # データがうまく取得できていない場合スキップ
+            return
+
+        # 最新の足は未確定なので除外
+        duals = self.index.update(self.symbol, self.timeframe, bars[:-1])
+        if len(duals) > 0:
+            return to_frame(duals, self.symbol, self.timeframe)
     
-async def run(symbol,client):
-    results = []
+async def run(symbol,client,index,writer):
+    count = 0
     timeframes = ['15', '60', '240']
     for timeframe in timeframes:
-        bot = mikeneko_dual(symbol, timeframe, client)
+        bot = mikeneko_dual(symbol, timeframe, client, index)
         result = await bot.get_Kline()
         if result is not None and not result.empty:
-            results.append(result)
-    return results
+            # 取得が終わった分から順に書き出す
+            writer.write(result)
+            count += len(result)
+    return count
 
-async def main():
-    all_results = []
+async def main(output=None):
     symbols = ['BTCUSDT', 'ETHUSDT', 'SUIUSDT', 'SOLUSDT']
-    async with pybotters.Client() as client:
-        symbol_results =    await asyncio.gather(*(run(symbol, client)for symbol in symbols ))
-
-    for results in symbol_results:
-            all_results.extend(results)
+    index = FractalIndex()
+    writer = open_writer(output)
+    try:
+        async with pybotters.Client() as client:
+            counts = await asyncio.gather(*(run(symbol, client, index, writer)for symbol in symbols ))
+    finally:
+        writer.close()
 
-    combined_df = pd.concat(all_results, ignore_index=True)
-    print(combined_df)
+    # 標準出力はスキャン結果用なのでログは標準エラーへ
+    if sum(counts) == 0:
+        print("📝 新しく確定したデュアルフラクタルはありません", file=sys.stderr)
+    else:
+        print(f"✅ デュアルフラクタル {sum(counts)}件出力", file=sys.stderr)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # python get_dual.py [出力先]  拡張子で形式を選択（.ndjson / .arrow / .parquet、省略時は標準出力へ NDJSON）
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
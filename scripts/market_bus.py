@@ -0,0 +1,278 @@
+"""
+共有メモリのマーケットデータバス
+- フィーダー（python market_bus.py）がローソク足・マーク価格・建玉・残高を取得し
+  multiprocessing.shared_memory に書き込む
+- 各スクリプトはネットワークを使わず共有メモリから読むだけ（読めなければ従来通りREST）
+- 建玉・残高は監視用。注文の判断（突き合わせ・決済数量）は常にRESTで取得する
+- 書き込みはシーケンス番号によるseqlock（奇数=書き込み中）で、読み手は番号が変わらなかった時だけ採用
+"""
+
+import asyncio
+import atexit
+import json
+import sys
+import time
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+if sys.platform.startswith('win'):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+BUS_VERSION = 1
+BUS_PREFIX = 'mikebot'
+base_url = 'https://api.bybit.com'
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'SUIUSDT', 'SOLUSDT']
+# (時間足, 本数)  entry.py は15分足500本、get_dual.py は15/60/240分足300本
+KLINE_FEEDS = [('15', 500), ('60', 300), ('240', 300)]
+FEED_INTERVAL = 5  # 秒
+MAX_POSITIONS = 64
+
+# 読み手が許容する鮮度（秒）
+KLINE_MAX_AGE = 30
+ACCOUNT_MAX_AGE = 15
+
+KLINE_DTYPE = np.dtype(np.float64)  # 列は warm_start.BAR_COLUMNS と同じ
+MARK_DTYPE = np.dtype([('symbol', 'S16'), ('mark_price', 'f8')])
+POSITION_DTYPE = np.dtype([('symbol', 'S16'), ('side', 'S4'), ('size', 'f8'), ('avg_price', 'f8'), ('unrealised_pnl', 'f8')])
+WALLET_DTYPE = np.dtype([('wallet_balance', 'f8')])
+
+# ヘッダー: [seq, 更新時刻(ms), 行数, バージョン]
+HEADER_FIELDS = 4
+HEADER_BYTES = HEADER_FIELDS * 8
+
+class SeqlockSegment:
+    """ヘッダー付きの固定長配列を共有メモリに置き、seqlockで読み書き"""
+    def __init__(self, name, dtype, shape, create=False):
+        self.name = f"{BUS_PREFIX}_{name}"
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        size = HEADER_BYTES + int(np.prod(self.shape)) * self.dtype.itemsize
+
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+            except FileExistsError:
+                # 前回のフィーダーの残骸は作り直す
+                old = shared_memory.SharedMemory(name=self.name)
+                old.close()
+                old.unlink()
+                self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            # 読み手の終了時に resource_tracker がセグメントを消してしまうのを防ぐ
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+            if self.shm.size < size:
+                self.shm.close()
+                raise ValueError(f"{self.name} のサイズが想定と異なります")
+
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.body = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if create:
+            self.header[:] = [0, 0, 0, BUS_VERSION]
+
+    def write(self, data):
+        rows = len(data)
+        self.header[0] += 1  # 奇数: 書き込み中
+        self.body[:rows] = data
+        self.header[1] = int(time.time() * 1000)
+        self.header[2] = rows
+        self.header[0] += 1  # 偶数: 書き込み完了
+
+    def read(self, max_age=None, retries=1000):
+        """整合の取れた内容を返す（未書き込み・古い・バージョン違いは None）"""
+        for _ in range(retries):
+            seq = int(self.header[0])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            version, updated_ms, rows = int(self.header[3]), int(self.header[1]), int(self.header[2])
+            data = self.body[:rows].copy()
+            if int(self.header[0]) != seq:
+                continue
+            if seq == 0 or version != BUS_VERSION:
+                return None
+            if max_age is not None and time.time() * 1000 - updated_ms > max_age * 1000:
+                return None
+            return data
+        return None
+
+    def close(self, unlink=False):
+        del self.header, self.body
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+def _kline_segment(symbol, interval, limit, create=False):
+    return SeqlockSegment(f"kline_{symbol}_{interval}", KLINE_DTYPE, (limit, 7), create)
+
+def _attach(factory, *args):
+    try:
+        return factory(*args)
+    except (FileNotFoundError, ValueError):
+        return None
+
+_segments = {}
+
+@atexit.register
+def _close_segments():
+    for segment in _segments.values():
+        if segment is not None:
+            segment.close()
+    _segments.clear()
+
+def _read(key, factory, args, max_age):
+    """読み手側: セグメントは初回だけ接続して使い回す"""
+    if key not in _segments:
+        _segments[key] = _attach(factory, *args)
+    segment = _segments[key]
+    return segment.read(max_age) if segment is not None else None
+
+# ===========================================
+# 読み手用
+# ===========================================
+def read_klines(symbol, interval, limit, max_age=KLINE_MAX_AGE):
+    """ローソク足（古い順、最新足は未確定）。バスから取れなければ None"""
+    feed_limit = dict(KLINE_FEEDS).get(interval)
+    if symbol not in SYMBOLS or feed_limit is None or limit > feed_limit:
+        return None
+    bars = _read(('kline', symbol, interval), _kline_segment, (symbol, interval, feed_limit), max_age)
+    if bars is None or len(bars) == 0:
+        return None
+    # 足の確定直後はフィーダーがまだ新しい足を取り込んでいないことがある（確定した足を未確定として扱わないように）
+    interval_ms = int(interval) * 60 * 1000
+    if bars[-1, 0] < int(time.time() * 1000) // interval_ms * interval_ms:
+        return None
+    return bars[-limit:]
+
+def read_mark_prices(max_age=KLINE_MAX_AGE):
+    marks = _read(('mark',), SeqlockSegment, ('mark', MARK_DTYPE, (len(SYMBOLS),)), max_age)
+    if marks is None:
+        return None
+    return {row['symbol'].decode(): float(row['mark_price']) for row in marks}
+
+def read_positions(account_name, max_age=ACCOUNT_MAX_AGE):
+    """建玉一覧（size>0のみ、/v5/position/list と同じキー名）。バスから取れなければ None
+
+    数秒遅れることがあるので監視専用（突き合わせや決済数量にはRESTを使う）
+    """
+    rows = _read(('positions', account_name), SeqlockSegment, (f"positions_{account_name}", POSITION_DTYPE, (MAX_POSITIONS,)), max_age)
+    if rows is None:
+        return None
+    return [
+        {
+            'symbol': row['symbol'].decode(),
+            'side': row['side'].decode(),
+            'size': float(row['size']),
+            'avgPrice': float(row['avg_price']),
+            'unrealisedPnl': float(row['unrealised_pnl']),
+        }
+        for row in rows
+    ]
+
+def read_wallet_balance(account_name, max_age=ACCOUNT_MAX_AGE):
+    """USDT残高。バスから取れなければ None"""
+    rows = _read(('wallet', account_name), SeqlockSegment, (f"wallet_{account_name}", WALLET_DTYPE, (1,)), max_age)
+    if rows is None or len(rows) == 0:
+        return None
+    return float(rows[0]['wallet_balance'])
+
+# ===========================================
+# フィーダー
+# ===========================================
+async def _get(client, endpoint, params):
+    res = await client.fetch("GET", url=f"{base_url}{endpoint}", params=params)
+    data = json.loads(res.text)
+    if data.get('retCode') != 0:
+        raise RuntimeError(f"{endpoint}: {data.get('retMsg')}")
+    return data.get('result', {}).get('list', [])
+
+class KlineFeed:
+    """初回は全件、以降は直近数本だけ取得して手元の配列に反映"""
+    def __init__(self, symbol, interval, limit):
+        self.symbol = symbol
+        self.interval = interval
+        self.limit = limit
+        self.interval_ms = int(interval) * 60 * 1000
+        self.bars = None
+        self.segment = _kline_segment(symbol, interval, limit, create=True)
+
+    async def update(self, client):
+        limit = self.limit if self.bars is None else 3
+        params = {'category': "linear", 'symbol': self.symbol, 'interval': self.interval, 'limit': str(limit)}
+        rows = await _get(client, "/v5/market/kline", params)
+        latest = np.array(rows, dtype=float).reshape(-1, 7)
+        latest = latest[np.argsort(latest[:, 0])]
+        if len(latest) == 0:
+            return
+
+        if self.bars is None or latest[0, 0] > self.bars[-1, 0] + self.interval_ms:
+            if self.bars is not None:
+                # 取りこぼしがあれば次回全件取り直し
+                self.bars = None
+                return
+            self.bars = latest
+        else:
+            self.bars = np.vstack([self.bars[self.bars[:, 0] < latest[0, 0]], latest])[-self.limit:]
+        self.segment.write(self.bars)
+
+async def feed_account(account, client, positions_segment, wallet_segment):
+    pos_list = await _get(client, "/v5/position/list", {'category': 'linear', 'settleCoin': 'USDT'})
+    rows = [
+        (pos['symbol'], pos['side'], float(pos['size']), float(pos.get('avgPrice') or 0), float(pos.get('unrealisedPnl') or 0))
+        for pos in pos_list if float(pos.get('size', 0)) > 0
+    ][:MAX_POSITIONS]
+    positions_segment.write(np.array(rows, dtype=POSITION_DTYPE))
+
+    coins = await _get(client, "/v5/account/wallet-balance", {"accountType": "UNIFIED"})
+    usdt_info = next(c for acc in coins for c in acc['coin'] if c['coin'] == 'USDT')
+    wallet_segment.write(np.array([(float(usdt_info['walletBalance']),)], dtype=WALLET_DTYPE))
+
+async def feed_marks(client, mark_segment):
+    tickers = {t['symbol']: t for t in await _get(client, "/v5/market/tickers", {'category': 'linear'})}
+    rows = [(symbol, float(tickers[symbol]['markPrice'])) for symbol in SYMBOLS if symbol in tickers]
+    mark_segment.write(np.array(rows, dtype=MARK_DTYPE))
+
+async def run_feeder():
+    import pybotters
+    from accounts import load_accounts
+
+    accounts = load_accounts()
+    kline_feeds = [KlineFeed(symbol, interval, limit) for symbol in SYMBOLS for interval, limit in KLINE_FEEDS]
+    mark_segment = SeqlockSegment('mark', MARK_DTYPE, (len(SYMBOLS),), create=True)
+    account_segments = {
+        account['name']: (
+            SeqlockSegment(f"positions_{account['name']}", POSITION_DTYPE, (MAX_POSITIONS,), create=True),
+            SeqlockSegment(f"wallet_{account['name']}", WALLET_DTYPE, (1,), create=True),
+        )
+        for account in accounts
+    }
+    segments = [feed.segment for feed in kline_feeds] + [mark_segment] + [s for pair in account_segments.values() for s in pair]
+    print(f"📡 マーケットデータバス開始: {len(segments)}セグメント")
+
+    try:
+        async with pybotters.Client() as market_client:
+            account_clients = [(account, pybotters.Client(apis=account['apis'])) for account in accounts]
+            try:
+                while True:
+                    started = time.monotonic()
+                    tasks = [feed.update(market_client) for feed in kline_feeds]
+                    tasks.append(feed_marks(market_client, mark_segment))
+                    tasks += [feed_account(account, client, *account_segments[account['name']]) for account, client in account_clients]
+                    for result in await asyncio.gather(*tasks, return_exceptions=True):
+                        if isinstance(result, Exception):
+                            print(f"⚠️ バス更新エラー: {''.join(traceback.format_exception_only(result)).strip()}")
+                    await asyncio.sleep(max(0, FEED_INTERVAL - (time.monotonic() - started)))
+            finally:
+                for _, client in account_clients:
+                    await client.close()
+    finally:
+        for segment in segments:
+            segment.close(unlink=True)
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run_feeder())
+    except KeyboardInterrupt:
+        print("📡 マーケットデータバス停止")
@@ -0,0 +1,158 @@
+"""
+通知サービス（python notify_service.py で常駐）
+- 各スクリプトは discord.py の notify_* からスプール（notify_spool/）にイベントを書くだけ
+- ハートビート（notify_dual_discord）は件数・最終時刻を集計し、DIGEST_MINUTES ごとにダイジェストを1通送信
+  （前回届いていたのに今回届かなかったものは ⚠️ で表示）
+- エラー（notify_error_discord）は銘柄違いの同じエラーをまとめ、DEDUP_MINUTES 以内の再発は件数だけ数えてダイジェストに載せる
+- critical=True のエラー（緊急ストップなど）はサービスを通さず即時送信
+- サービスが止まっている間は各スクリプトが従来通り直接送信する
+"""
+
+import json
+import os
+import re
+import time
+import traceback
+from datetime import datetime
+from discord import SPOOL_DIR, SERVICE_ALIVE_FILE, send_dual_discord, send_error_discord
+
+POLL_INTERVAL = 2          # 秒
+ERROR_BATCH_SECONDS = 30   # 初回のエラーはこの間に届いた銘柄違いをまとめてから送信
+DEDUP_MINUTES = 60         # 同じエラーの再送を抑制する時間
+DIGEST_MINUTES = 60        # ハートビートのダイジェスト間隔
+
+state_file = SPOOL_DIR / 'state.json'
+SYMBOL_PATTERN = re.compile(r'[A-Z0-9]{2,}USDT')
+
+def error_key(subtitle, error_message):
+    """銘柄名を除いたタイトルと最後の行（例外メッセージ）で同じエラーを判定"""
+    lines = str(error_message or '').strip().splitlines()
+    last_line = lines[-1] if lines else ''
+    return SYMBOL_PATTERN.sub('*', f"{subtitle}|{last_line}")
+
+def new_state(now):
+    return {'heartbeats': {}, 'errors': {}, 'last_digest': now}
+
+def load_state(now):
+    if state_file.exists():
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 通知サービスの状態読み込み失敗: {str(e)}")
+    return new_state(now)
+
+def save_state(state):
+    tmp_path = state_file.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_file)
+
+def read_events():
+    """スプールのイベントを古い順に読み出して削除"""
+    events = []
+    for path in sorted(SPOOL_DIR.glob('*.event')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                events.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ {path.name} 読み込み失敗: {str(e)}")
+        path.unlink(missing_ok=True)
+    return events
+
+def apply_event(state, event):
+    """ハートビートは件数・最終時刻、エラーは重複キーごとに件数と銘柄を集計"""
+    t = event.get('time', time.time())
+    if event.get('kind') == 'heartbeat':
+        beat = state['heartbeats'].setdefault(event['msg'], {'count': 0, 'prev_count': 0, 'last': t})
+        beat['count'] += 1
+        beat['last'] = max(beat['last'], t)
+    elif event.get('kind') == 'error':
+        subtitle, error_message = event.get('subtitle'), event.get('error_message')
+        error = state['errors'].setdefault(error_key(subtitle, error_message), {
+            'subtitle': subtitle, 'error_message': error_message, 'symbols': [],
+            'first': t, 'last': t, 'count': 0, 'suppressed': 0, 'sent': None,
+        })
+        if error['sent'] is not None and t - error['sent'] >= DEDUP_MINUTES * 60:
+            # 抑制期間が過ぎたら新しいエラーとして扱う
+            error.update(subtitle=subtitle, error_message=error_message, symbols=[], first=t, count=0, sent=None)
+        if error['sent'] is None:
+            error['count'] += 1
+        else:
+            error['suppressed'] += 1
+        error['last'] = t
+        error['symbols'] = sorted(set(error['symbols']) | set(SYMBOL_PATTERN.findall(f"{subtitle} {error_message}")))
+
+def send_errors(state, now):
+    """未送信のエラーを、最初の発生から ERROR_BATCH_SECONDS 待ってまとめて送信"""
+    for error in state['errors'].values():
+        if error['sent'] is not None or now - error['first'] < ERROR_BATCH_SECONDS:
+            continue
+        message = error['error_message']
+        if error['count'] > 1:
+            symbols = f"（{', '.join(error['symbols'])}）" if error['symbols'] else ''
+            message = f"{message}\n\n同じエラー {error['count']}件{symbols}"
+        if send_error_discord(error['subtitle'], message, datetime.fromtimestamp(error['first'])):
+            error['sent'] = now
+
+def send_digest(state, now):
+    """ハートビートの集計と抑制したエラーの件数をまとめて送信"""
+    period_hours = (now - state['last_digest']) / 3600
+    fields = []
+    for msg, beat in sorted(state['heartbeats'].items()):
+        if beat['count'] == 0 and beat['prev_count'] < 2:
+            continue  # 件数入りの一度きりの通知などは途絶扱いしない
+        stopped = beat['count'] == 0  # 前回の期間には定期的に届いていた
+        last = datetime.fromtimestamp(beat['last']).strftime('%m-%d %H:%M')
+        fields.append({"name": f"{'⚠️ ' if stopped else ''}{msg}"[:256], "value": f"`{beat['count']}回 / 最終 {last}`", "inline": False})
+    suppressed = [e for e in state['errors'].values() if e['suppressed']]
+    for error in sorted(suppressed, key=lambda e: e['suppressed'], reverse=True):
+        fields.append({"name": f"🔁 {error['subtitle']}"[:256], "value": f"`抑制 {error['suppressed']}件`", "inline": False})
+
+    if not send_dual_discord(f"📊 稼働ダイジェスト（直近{period_hours:.1f}時間）", fields[:24]):  # embed のフィールド上限25
+        return
+    for beat in state['heartbeats'].values():
+        beat['prev_count'], beat['count'] = beat['count'], 0
+    # この期間に届かなかったものは集計から外す（途絶の ⚠️ は1回だけ表示）
+    state['heartbeats'] = {msg: beat for msg, beat in state['heartbeats'].items() if beat['prev_count']}
+    for error in suppressed:
+        error['suppressed'] = 0
+    state['last_digest'] = now
+
+def prune(state, now):
+    """抑制期間を過ぎて再発していないエラーを削除"""
+    state['errors'] = {
+        key: error for key, error in state['errors'].items()
+        if error['sent'] is None or error['suppressed'] or now - error['last'] < DEDUP_MINUTES * 60
+    }
+
+def run_once(state):
+    now = time.time()
+    for event in read_events():
+        apply_event(state, event)
+    send_errors(state, now)
+    if now - state['last_digest'] >= DIGEST_MINUTES * 60:
+        send_digest(state, now)
+    prune(state, now)
+    save_state(state)
+    SERVICE_ALIVE_FILE.touch()  # 1周処理できた時だけ生存確認を更新
+
+def main():
+    SPOOL_DIR.mkdir(exist_ok=True)
+    state = load_state(time.time())
+    print(f"📮 通知サービス開始: {SPOOL_DIR.resolve()}")
+    while True:
+        try:
+            run_once(state)
+        except Exception as e:
+            print(f"❌ 通知サービスエラー: {str(e)}")
+            traceback.print_exc()
+        time.sleep(POLL_INTERVAL)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        # 止めた後は各スクリプトが直接送信に戻る
+        SERVICE_ALIVE_FILE.unlink(missing_ok=True)
+        print("📮 通知サービス停止")
@@ -1,27 +1,41 @@
+import sys
+from accounts import load_accounts, account_file
+from fast_start import has_local_positions, LazyClient
+
+accounts = load_accounts()
+file_name = 'position_status.json'
+
+# ポジションが無ければ重いモジュールを読み込まずに終了（cronのほとんどの回）
+if __name__ == '__main__' and not has_local_positions(file_name, accounts):
+    print("📝 監視対象のポジションはありません")
+    sys.exit(0)
+
 from datetime import datetime, timedelta
 import os
-import pybotters
-from pathlib import Path
+import math
+import time
 import asyncio
-import sys
 import json
 import traceback
 from discord import notify_error_discord, notify_dual_discord, notify_discord
+from profiling import profiled_run
+from execution_tracker import ExecutionTracker, execution_file
+import trade_journal
+from trade_journal import journal_file
 
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-config_path = Path(__file__).parent.parent / 'config' / 'config.json'
-with open(config_path, encoding='utf-8') as f:
-    config = json.load(f)
-apis = {"bybit": [config['api_key'], config['api_secret']]}
-
 symbols = ['BTCUSDT', 'ETHUSDT', 'SUIUSDT', 'SOLUSDT']
 max_holding_bars = {'BTCUSDT':1312, 'ETHUSDT':608, 'SUIUSDT':968, 'SOLUSDT':968}
-file_name = 'position_status.json'
-url = 'https://api.bybit.com/v5/order/create'
+base_url = 'https://api.bybit.com'
+position_list_url = f'{base_url}/v5/position/list'
+closed_pnl_url = f'{base_url}/v5/position/closed-pnl'
+CLOSED_PNL_MAX_RANGE_MS = 7 * 24 * 3600 * 1000  # closed-pnl の検索範囲は最大7日
+TP_TOLERANCE = 0.001  # 利確の成行約定で許容する不利なずれ
+batch_size = 10  # バッチ注文1回あたりの最大件数
 
-def load_positions():
+def load_positions(file_name=file_name):
     """ポジション状態を読み込み"""
     if os.path.exists(file_name):
         try:
@@ -55,7 +69,7 @@ def load_positions():
     
     return {}
 
-def save_positions(positions):
+def save_positions(positions, file_name=file_name):
     """ポジション状態を保存"""
     # datetimeを文字列に変換
     positions_to_save = {}
@@ -67,13 +81,114 @@ def save_positions(positions):
     with open(file_name, 'w') as f:
         json.dump(positions_to_save, f, indent=2)
 
-async def close_position(symbol, positions, client):
-    """ポジションをクローズ"""
-    if symbol not in positions:
-        return
-        
-    position_info = positions[symbol]
-    now = datetime.now()
+async def get_exchange_positions(client):
+    """取引所の建玉を1回のリクエストでまとめて取得
+
+    突き合わせ・決済の判断に使うため、数秒遅れることがあるマーケットデータバスではなく常にRESTで取得する
+    """
+    params = {
+        'category': 'linear',
+        'settleCoin': 'USDT'
+    }
+    response = await client.fetch("GET", url=position_list_url, params=params)
+
+    if not response.text:
+        print("❌ ポジション情報の空レスポンス")
+        return None
+
+    data = json.loads(response.text)
+    if data.get('retCode') != 0:
+        print(f"❌ ポジション取得エラー: {data.get('retMsg')}")
+        return None
+
+    exchange_positions = {}
+    for pos in data.get('result', {}).get('list', []):
+        size = float(pos.get('size', 0))
+        if size > 0:
+            exchange_positions[pos.get('symbol')] = {
+                'side': pos.get('side'),
+                'size': pos.get('size'),
+                'mark_price': float(pos.get('markPrice') or 'nan'),
+            }
+    return exchange_positions
+
+async def fetch_closed_exit(client, symbol, since_ms):
+    """取引所側で決済されたポジションの実際の決済（/v5/position/closed-pnl）。見つからなければ None"""
+    params = {
+        'category': 'linear',
+        'symbol': symbol,
+        'startTime': str(max(since_ms, int(time.time() * 1000) - CLOSED_PNL_MAX_RANGE_MS)),
+        'limit': '50',
+    }
+    response = await client.fetch("GET", url=closed_pnl_url, params=params)
+    data = json.loads(response.text)
+    if data.get('retCode') != 0:
+        print(f"❌ {symbol} 決済履歴取得エラー: {data.get('retMsg')}")
+        return None
+    records = [r for r in data.get('result', {}).get('list', []) if int(r.get('createdTime', 0)) >= since_ms]
+    if not records:
+        return None
+
+    # 分割して決済された場合は数量加重平均
+    sizes = [float(r['closedSize']) for r in records]
+    return {
+        'exit_price': sum(float(r['avgExitPrice']) * size for r, size in zip(records, sizes)) / sum(sizes),
+        'exit_ms': max(int(r['updatedTime']) for r in records),
+        'order_id': records[0].get('orderId', ''),
+        'exec_types': {r.get('execType') for r in records},
+    }
+
+def closed_reason(position_info, closed_exit):
+    """決済理由（清算・ADL・利確・それ以外の決済）"""
+    if 'BustTrade' in closed_exit['exec_types']:
+        return 'liquidation'
+    if 'AdlTrade' in closed_exit['exec_types']:
+        return 'adl'
+    take_profit = position_info.get('exit_price')
+    if take_profit is not None:
+        direction = trade_journal.direction_from_close_side(position_info.get('side'))
+        if (closed_exit['exit_price'] - take_profit) * direction >= -take_profit * TP_TOLERANCE:
+            return 'tp'
+    return 'closed'
+
+async def reconcile_positions(positions, exchange_positions, client, journal_path=journal_file):
+    """ローカル状態と取引所の建玉を突き合わせ、決済済みのものを削除（実際の決済は決済履歴から取得）"""
+    closed_symbols = [symbol for symbol in positions if symbol not in exchange_positions]
+
+    for symbol in closed_symbols:
+        position_info = positions.pop(symbol)
+        timestamp = position_info.get('timestamp')
+        entry_ms = int(timestamp.timestamp() * 1000) if hasattr(timestamp, 'timestamp') else 0
+        try:
+            closed_exit = await fetch_closed_exit(client, symbol, entry_ms)
+        except Exception as e:
+            print(f"⚠️ {symbol} 決済履歴取得エラー: {str(e)}")
+            closed_exit = None
+
+        if closed_exit is None and not trade_journal.is_filled(position_info):
+            # エントリーが約定していなかったものはトレードとして記録しない
+            print(f"📝 {symbol} は取引所に建玉が無いため削除（エントリー未約定）")
+            continue
+
+        if closed_exit is None:
+            # 清算・手動決済などで決済履歴も取れない場合は価格不明として記録（集計からは除外される）
+            reason, exit_price, exit_ms, order_id = 'unknown', float('nan'), None, ''
+        else:
+            reason = closed_reason(position_info, closed_exit)
+            exit_price, exit_ms, order_id = closed_exit['exit_price'], closed_exit['exit_ms'], closed_exit['order_id']
+        print(f"📝 {symbol} は取引所側で決済済み（{reason}）のため削除")
+        trade_journal.record_close_from_position(symbol, position_info, reason, exit_price, exit_ms, order_id, path=journal_path)
+        notify_discord(
+            symbol=symbol,
+            qty=position_info.get('qty', 'N/A'),
+            entry_price=position_info.get('entry_price', 'N/A'),
+            exit_price=exit_price if closed_exit is not None else '取得不可'
+        )
+
+    return closed_symbols
+
+def is_holding_expired(symbol, position_info, now):
+    """最大保有時間を超えているかチェック"""
     close_hours = max_holding_bars[symbol] / 4
 
     # 時間判定
@@ -89,94 +204,153 @@ async def close_position(symbol, positions, client):
     else:
         timestamp = now
         notify_error_discord(subtitle="timestamp不足", error_message=f"{symbol}でtimestampが見つかりません")
-        
-    # 保有時間チェック
-    if now <= timestamp + timedelta(hours=close_hours):
-        return
-    
-    try:
-        params = {
-            'category': "linear",
-            'symbol': symbol,
-            'orderType': "Market",
-            'side': position_info["side"],
-            'qty': str(position_info['qty']),
-        }
-        
-        response = await client.fetch("POST", url=url, data=params)
-        
-        # レスポンスの詳細チェック
-        if not response.text:
-            print(f"❌ {symbol} 空のレスポンス")
-            notify_error_discord(subtitle="API応答なし", error_message=f"{symbol}で空のレスポンスが返されました")
-            return
-        
-        print(f"🔍 {symbol} レスポンス: {response.text[:200]}...")  # デバッグ用
-        
+
+    return now > timestamp + timedelta(hours=close_hours)
+
+async def close_positions(symbols_to_close, positions, exchange_positions, client, tracker, journal_path=journal_file):
+    """保有時間を超えたポジションをバッチ注文でまとめてクローズ"""
+    closed = []
+    order_ids = {}
+
+    for i in range(0, len(symbols_to_close), batch_size):
+        chunk = symbols_to_close[i:i + batch_size]
+        # 決済方向と数量は取引所の建玉を正とする
+        orders = [
+            {
+                'symbol': symbol,
+                'orderType': "Market",
+                'side': "Sell" if exchange_positions[symbol]['side'] == "Buy" else "Buy",
+                'qty': str(exchange_positions[symbol]['size']),
+                'reduceOnly': True,
+            }
+            for symbol in chunk
+        ]
+
         try:
-            result = json.loads(response.text)
-        except json.JSONDecodeError as e:
-            print(f"❌ {symbol} JSON解析エラー: {str(e)}")
-            print(f"❌ レスポンス内容: '{response.text}'")
-            notify_error_discord(
-                subtitle="JSON解析エラー", 
-                error_message=f"{symbol}: {str(e)}\nレスポンス: {response.text[:500]}"
-            )
-            return
-        
-        # API結果チェック
-        if result.get('retCode') == 0:
-            print(f"✅ {symbol} クローズ成功")
-            notify_discord(
-                symbol=symbol,
-                qty=position_info['qty'], 
-                entry_price=position_info.get('entry_price', 'N/A'), 
-                exit_price=position_info.get('exit_price', 'Market価格')
-            )
-            del positions[symbol]
-            save_positions(positions)
-        else:
-            error_msg = result.get('retMsg', 'Unknown error')
-            print(f"❌ {symbol} クローズ失敗: {error_msg}")
-            notify_error_discord(subtitle="クローズ失敗", error_message=f"{symbol}: {error_msg}")
-            
-    except Exception as e:
-        error_msg = traceback.format_exc()
-        print(f"❌ {symbol} 予期しないエラー: {str(e)}")
-        notify_error_discord(subtitle=f"{symbol} クローズ処理中にエラー発生", error_message=error_msg)
+            expected_prices = {symbol: exchange_positions[symbol].get('mark_price') for symbol in chunk}
+            response = await tracker.send_batch(client, "linear", orders, purpose='close', expected_prices=expected_prices)
 
-async def main():
-    print(f"🔍 ポジション監視開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            # レスポンスの詳細チェック
+            if not response.text:
+                print(f"❌ {chunk} 空のレスポンス")
+                notify_error_discord(subtitle="API応答なし", error_message=f"{', '.join(chunk)}で空のレスポンスが返されました")
+                continue
+
+            print(f"🔍 バッチ レスポンス: {response.text[:200]}...")  # デバッグ用
+
+            try:
+                result = json.loads(response.text)
+            except json.JSONDecodeError as e:
+                print(f"❌ {chunk} JSON解析エラー: {str(e)}")
+                print(f"❌ レスポンス内容: '{response.text}'")
+                notify_error_discord(
+                    subtitle="JSON解析エラー",
+                    error_message=f"{', '.join(chunk)}: {str(e)}\nレスポンス: {response.text[:500]}"
+                )
+                continue
+
+            # API結果チェック
+            if result.get('retCode') != 0:
+                error_msg = result.get('retMsg', 'Unknown error')
+                print(f"❌ {chunk} クローズ失敗: {error_msg}")
+                notify_error_discord(subtitle="クローズ失敗", error_message=f"{', '.join(chunk)}: {error_msg}")
+                continue
+
+            # 注文ごとの結果は retExtInfo.list にリクエスト順で返る
+            order_results = result.get('retExtInfo', {}).get('list', [])
+            created = result.get('result', {}).get('list', [])
+            for symbol, order_result, order in zip(chunk, order_results, created):
+                if order_result.get('code') == 0:
+                    print(f"✅ {symbol} クローズ成功")
+                    order_ids[symbol] = order.get('orderId')
+                    closed.append(symbol)
+                else:
+                    error_msg = order_result.get('msg', 'Unknown error')
+                    print(f"❌ {symbol} クローズ失敗: {error_msg}")
+                    notify_error_discord(subtitle="クローズ失敗", error_message=f"{symbol}: {error_msg}")
+
+        except Exception as e:
+            error_msg = traceback.format_exc()
+            print(f"❌ {chunk} 予期しないエラー: {str(e)}")
+            notify_error_discord(subtitle=f"{', '.join(chunk)} クローズ処理中にエラー発生", error_message=error_msg)
+
+    # 実際の約定価格を取得してから通知
+    # 失敗した注文も計測対象なので、クローズできた銘柄が無くても必ず記録する
+    fills = await tracker.flush(client)
+    for symbol in closed:
+        position_info = positions.pop(symbol)
+        fill = fills.get(order_ids.get(symbol))
+        exit_price = float(fill['fill_price']) if fill is not None and not math.isnan(fill['fill_price']) else 'Market価格'
+        trade_journal.record_close_from_position(
+            symbol, position_info, 'time',
+            exit_price if exit_price != 'Market価格' else exchange_positions[symbol].get('mark_price') or float('nan'),
+            order_id=order_ids.get(symbol), path=journal_path,
+        )
+        notify_discord(
+            symbol=symbol,
+            qty=position_info['qty'],
+            entry_price=position_info.get('entry_price', 'N/A'),
+            exit_price=exit_price
+        )
+
+    return closed
+
+async def watch_account(account):
+    """口座ごとのポジション監視"""
+    name = account['name']
+    state_file = account_file(file_name, name)
+    print(f"🔍 [{name}] ポジション監視開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
-        positions = load_positions()
+        positions = load_positions(state_file)
         if not positions:
-            print("📝 監視対象のポジションはありません")
+            print(f"📝 [{name}] 監視対象のポジションはありません")
             return
         
-        print(f"📊 監視対象: {list(positions.keys())}")
+        print(f"📊 [{name}] 監視対象: {list(positions.keys())}")
         
-        async with pybotters.Client(apis=apis) as client:
-            tasks = []
-            for symbol in symbols:
-                if symbol in positions:
-                    tasks.append(close_position(symbol, positions, client))
-            
-            if tasks:
-                await asyncio.gather(*tasks)
-                print(f"✅ ポジション監視完了 - {len(tasks)}件処理")
-                notify_dual_discord(msg=f"✅ ポジションうぉっちゃ～{len(tasks)}処理執行")
+        async with LazyClient(apis=account['apis']) as client:
+            exchange_positions = await get_exchange_positions(client)
+            if exchange_positions is None:
+                # 取引所の状態が確認できないまま成行注文を出すと意図しない建玉を作るため中断
+                notify_error_discord(subtitle="ポジション照合失敗", error_message=f"[{name}] /v5/position/list の取得に失敗しました")
+                return
+
+            # 1. 取引所側で決済済み（TP約定など）のものを削除
+            journal_path = account_file(journal_file, name)
+            closed_symbols = await reconcile_positions(positions, exchange_positions, client, journal_path)
+
+            # 2. 保有時間を超えたものをまとめてクローズ
+            now = datetime.now()
+            expired = [
+                symbol for symbol in symbols
+                if symbol in positions and is_holding_expired(symbol, positions[symbol], now)
+            ]
+            if expired:
+                tracker = ExecutionTracker(account_file(execution_file, name))
+                closed_symbols += await close_positions(expired, positions, exchange_positions, client, tracker, journal_path)
+
+            if closed_symbols:
+                save_positions(positions, state_file)
+
+            if expired:
+                print(f"✅ [{name}] ポジション監視完了 - {len(expired)}件処理")
+                notify_dual_discord(msg=f"✅ [{name}] ポジションうぉっちゃ～{len(expired)}処理執行")
             else:
-                print("📝 処理対象のポジションはありませんでした")
+                print(f"📝 [{name}] 処理対象のポジションはありませんでした")
             
-            notify_dual_discord(msg="✅ ポジションうぉっちゃ～動作正常")
+            notify_dual_discord(msg=f"✅ [{name}] ポジションうぉっちゃ～動作正常")
     except Exception as e:
         error_msg = traceback.format_exc()
-        print(f"❌ メイン処理エラー: {str(e)}")
+        print(f"❌ [{name}] メイン処理エラー: {str(e)}")
         notify_error_discord(
-            subtitle="ポジション監視システムエラー",
+            subtitle=f"[{name}] ポジション監視システムエラー",
             error_message=error_msg
         )
 
+async def main():
+    # 口座ごとに独立したセッション・状態ファイルで並行監視
+    await asyncio.gather(*(watch_account(account) for account in accounts))
+
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    profiled_run(main())
\ No newline at end of file
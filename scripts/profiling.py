@@ -0,0 +1,127 @@
+"""
+プロファイリングモード（環境変数 MIKEBOT_PROFILE=1 または --profile で有効）
+- cProfile と tracemalloc で1回の実行を計測
+- イベントループを閾値以上ブロックした処理をスタック付きで記録
+- 実行ごとに profiles/ にレポートを出力
+"""
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+PROFILE_FLAG = '--profile'
+PROFILE_DIR = Path('profiles')
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get('MIKEBOT_LOOP_LAG_MS', 100))
+TOP_N = 30
+
+def enabled():
+    """プロファイリングモードが有効か"""
+    return os.environ.get('MIKEBOT_PROFILE', '') not in ('', '0') or PROFILE_FLAG in sys.argv
+
+class LoopLagMonitor:
+    """ループ内のハートビートが途切れたら、別スレッドからループのスタックを記録"""
+    def __init__(self, threshold_ms=LOOP_LAG_THRESHOLD_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = max(self.threshold / 4, 0.005)
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.stalls = []  # {'started': 経過秒, 'lag': 秒, 'stack': str}
+        self._current = None
+        self._stop = threading.Event()
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    async def heartbeat(self):
+        while True:
+            self.last_beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._finish_stall()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            lag = time.perf_counter() - self.last_beat
+            if lag < self.threshold:
+                self._finish_stall()
+            elif self._current is None:
+                # ブロック中のスタックを取得（ループスレッドはまだその処理の中にいる）
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame else '(スタック取得不可)'
+                self._current = {'started': self.last_beat - self._started_at, 'lag': lag, 'stack': stack}
+            else:
+                self._current['lag'] = lag
+
+    def _finish_stall(self):
+        if self._current is not None:
+            self.stalls.append(self._current)
+            self._current = None
+
+async def _run_with_monitor(coro, monitor):
+    heartbeat = asyncio.create_task(monitor.heartbeat())
+    try:
+        return await coro
+    finally:
+        heartbeat.cancel()
+
+def write_report(script, elapsed, profiler, memory_snapshot, peak_memory, monitor):
+    """計測結果をテキストレポートに出力"""
+    PROFILE_DIR.mkdir(exist_ok=True)
+    path = PROFILE_DIR / f"{script}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+
+    out = io.StringIO()
+    out.write(f"# {script} プロファイル {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    out.write(f"実行時間: {elapsed:.3f}s\n\n")
+
+    out.write(f"## ループブロック（{monitor.threshold * 1000:.0f}ms以上）: {len(monitor.stalls)}件\n")
+    for stall in sorted(monitor.stalls, key=lambda s: s['lag'], reverse=True):
+        out.write(f"\n### {stall['lag'] * 1000:.0f}ms（開始 +{stall['started']:.3f}s）\n{stall['stack']}")
+
+    out.write(f"\n## cProfile（累積時間 上位{TOP_N}）\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(TOP_N)
+
+    out.write(f"## tracemalloc（ピーク {peak_memory / 1024 / 1024:.1f}MiB、確保量 上位{TOP_N}）\n")
+    for stat in memory_snapshot.statistics('lineno')[:TOP_N]:
+        out.write(f"{stat}\n")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(out.getvalue())
+    return path
+
+def profiled_run(coro):
+    """asyncio.run の代わり。プロファイリングモードの時だけ計測してレポートを出力"""
+    if not enabled():
+        return asyncio.run(coro)
+
+    script = Path(sys.argv[0]).stem or 'python'
+    monitor = LoopLagMonitor()
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    started = time.perf_counter()
+    monitor.start()
+    profiler.enable()
+    try:
+        return asyncio.run(_run_with_monitor(coro, monitor))
+    finally:
+        profiler.disable()
+        monitor.stop()
+        elapsed = time.perf_counter() - started
+        memory_snapshot = tracemalloc.take_snapshot()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path = write_report(script, elapsed, profiler, memory_snapshot, peak_memory, monitor)
+        print(f"📈 プロファイルレポート出力: {path}")
@@ -0,0 +1,88 @@
+"""
+スキャン結果のストリーミング出力
+- 取得が終わった銘柄・時間足から順に1件ずつ書き出す（全件をメモリに溜めない）
+- NDJSON / Arrow IPC（ストリーム形式） / Parquet を出力先の拡張子で選択
+- Arrow / Parquet は pyarrow が入っている場合のみ（1件も無ければファイルを作らない）
+"""
+
+import sys
+from pathlib import Path
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+ARROW_SUFFIXES = ('.arrow', '.arrows', '.ipc')
+PARQUET_SUFFIXES = ('.parquet',)
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("Arrow / Parquet 出力には pyarrow が必要です（pip install pyarrow）")
+
+class NdjsonWriter:
+    """1行1レコードの JSON。書くたびに flush するので追いかけ読みできる"""
+    def __init__(self, path=None):
+        self.file = sys.stdout if path in (None, '-') else open(path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, df):
+        if df is None or df.empty:
+            return
+        self.file.write(df.to_json(orient='records', lines=True, date_format='iso', force_ascii=False))
+        self.file.flush()
+        self.count += len(df)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class ArrowIpcWriter:
+    """Arrow IPC ストリーム形式。書くたびにレコードバッチを1つ追加"""
+    def __init__(self, path):
+        self.pa = _import_pyarrow()
+        self.path = Path(path)
+        self.sink = self.pa.OSFile(str(path), 'wb')
+        self.writer = None
+        self.count = 0
+
+    def _table(self, df):
+        return self.pa.Table.from_pandas(df, preserve_index=False)
+
+    def _open(self, schema):
+        return self.pa.ipc.new_stream(self.sink, schema)
+
+    def write(self, df):
+        if df is None or df.empty:
+            return
+        table = self._table(df)
+        if self.writer is None:
+            self.writer = self._open(table.schema)
+        self.writer.write_table(table)
+        self.count += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.sink.close()
+        if self.writer is None:
+            # スキーマが決まらず開けない空ファイルになるので残さない
+            self.path.unlink(missing_ok=True)
+
+class ParquetWriter(ArrowIpcWriter):
+    """Parquet。書くたびに行グループを1つ追加（フッターは close 時に書かれる）"""
+    def _open(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.sink, schema)
+
+def open_writer(path=None):
+    """出力先の拡張子から書き出し方式を選択（指定なし・'-' は標準出力へ NDJSON）"""
+    if path in (None, '-'):
+        return NdjsonWriter()
+    suffix = Path(path).suffix.lower()
+    if suffix in NDJSON_SUFFIXES:
+        return NdjsonWriter(path)
+    if suffix in ARROW_SUFFIXES:
+        return ArrowIpcWriter(path)
+    if suffix in PARQUET_SUFFIXES:
+        return ParquetWriter(path)
+    raise ValueError(f"未対応の出力形式です: {path}（{NDJSON_SUFFIXES + ARROW_SUFFIXES + PARQUET_SUFFIXES}）")
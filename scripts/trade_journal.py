@@ -0,0 +1,176 @@
+"""
+追記専用のトレードジャーナル
+- エントリー（open）と決済（close）を固定長レコードで trade_journal.bin に追記
+- np.memmap で読み込み、時刻順・銘柄別のインデックスを trade_journal.idx.npz に保持
+- 勝率・銘柄別PnL・保有時間・ドローダウンを JSON を読まずに集計
+- python trade_journal.py [日数] [ファイル] で銘柄別の集計を表示
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+journal_file = 'trade_journal.bin'
+
+JOURNAL_DTYPE = np.dtype([
+    ('kind', 'S8'),          # open / close
+    ('symbol', 'S16'),
+    ('direction', 'i1'),     # 1=ロング -1=ショート
+    ('reason', 'S12'),       # entry / tp / time / emergency / liquidation / adl / closed / unknown
+    ('event_ms', 'i8'),      # open はエントリー時刻、close は決済時刻
+    ('qty', 'f8'),
+    ('entry_ms', 'i8'),
+    ('entry_price', 'f8'),
+    ('exit_ms', 'i8'),
+    ('exit_price', 'f8'),
+    ('pnl', 'f8'),           # USDT（手数料は含まない。価格不明なら NaN で集計対象外）
+    ('order_id', 'S40'),
+])
+
+def _to_ms(value):
+    if value is None:
+        return None
+    if hasattr(value, 'timestamp'):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+def direction_from_close_side(side):
+    """position_status.json の side（クローズ用に逆向き）から建玉の向き"""
+    return 1 if side == 'Sell' else -1
+
+def is_filled(position_info):
+    """エントリーが約定済みか（order_id を持たない旧形式の状態は約定済みとみなす）"""
+    return position_info.get('filled', 'order_id' not in position_info)
+
+def append(records, path=journal_file):
+    """レコードを追記"""
+    records = np.asarray(records, dtype=JOURNAL_DTYPE).reshape(-1)
+    with open(path, 'ab') as f:
+        records.tofile(f)
+
+def _record(kind, symbol, direction, reason, qty, entry_ms, entry_price, exit_ms=0, exit_price=np.nan, order_id=''):
+    record = np.zeros((), dtype=JOURNAL_DTYPE)
+    record['kind'] = kind
+    record['symbol'] = symbol
+    record['direction'] = direction
+    record['reason'] = reason
+    record['qty'] = float(qty)
+    record['entry_ms'] = entry_ms
+    record['entry_price'] = float(entry_price)
+    record['exit_ms'] = exit_ms
+    record['exit_price'] = float(exit_price)
+    record['event_ms'] = exit_ms if kind == 'close' else entry_ms
+    record['pnl'] = (float(exit_price) - float(entry_price)) * float(qty) * direction if kind == 'close' else 0.0
+    record['order_id'] = order_id or ''
+    return record
+
+def record_open(symbol, direction, qty, entry_price, entry_ms=None, order_id='', path=journal_file):
+    append(_record('open', symbol, direction, 'entry', qty, entry_ms or int(time.time() * 1000), entry_price, order_id=order_id), path)
+
+def record_close(symbol, direction, reason, qty, entry_price, entry_ms, exit_price, exit_ms=None, order_id='', path=journal_file):
+    append(_record('close', symbol, direction, reason, qty, entry_ms, entry_price,
+                   exit_ms or int(time.time() * 1000), exit_price, order_id), path)
+
+def record_close_from_position(symbol, position_info, reason, exit_price, exit_ms=None, order_id='', path=journal_file):
+    """position_status.json の1件から決済レコードを作成"""
+    timestamp = position_info.get('timestamp')
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    record_close(
+        symbol, direction_from_close_side(position_info.get('side')), reason, position_info['qty'],
+        position_info.get('entry_price', np.nan), _to_ms(timestamp) or 0, exit_price, exit_ms, order_id, path,
+    )
+
+class TradeJournal:
+    """ジャーナルを memmap で開き、インデックス経由で集計"""
+    def __init__(self, path=journal_file):
+        self.path = Path(path)
+        self.index_path = self.path.with_suffix('.idx.npz')
+        size = os.path.getsize(self.path) if self.path.exists() else 0
+        count = size // JOURNAL_DTYPE.itemsize  # 書き込み途中の端数は無視
+        self.records = np.memmap(self.path, dtype=JOURNAL_DTYPE, mode='r', shape=(count,)) if count else np.zeros(0, dtype=JOURNAL_DTYPE)
+        self._load_index()
+
+    def _load_index(self):
+        """件数が変わっていなければ保存済みのインデックスを使い、増えていれば作り直す"""
+        count = len(self.records)
+        if self.index_path.exists():
+            with np.load(self.index_path) as data:
+                if int(data['count']) == count:
+                    self.close_rows, self.close_times = data['close_rows'], data['close_times']
+                    self.symbols, self.symbol_starts, self.symbol_rows = data['symbols'], data['symbol_starts'], data['symbol_rows']
+                    return
+
+        # 時刻インデックス: 決済レコードを決済時刻順に
+        close_rows = np.flatnonzero(self.records['kind'] == b'close')
+        close_rows = close_rows[np.argsort(self.records['event_ms'][close_rows], kind='stable')]
+        self.close_rows = close_rows
+        self.close_times = self.records['event_ms'][close_rows]
+
+        # 銘柄インデックス: (銘柄, 時刻) 順に並べ、銘柄ごとの開始位置
+        by_symbol = np.argsort(self.records['symbol'][close_rows], kind='stable')
+        self.symbol_rows = close_rows[by_symbol]
+        self.symbols, self.symbol_starts = np.unique(self.records['symbol'][self.symbol_rows], return_index=True)
+
+        if count:
+            tmp_path = self.index_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, count=np.int64(count), close_rows=self.close_rows, close_times=self.close_times,
+                         symbols=self.symbols, symbol_starts=self.symbol_starts, symbol_rows=self.symbol_rows)
+            os.replace(tmp_path, self.index_path)
+
+    def trades(self, symbol=None, start=None, end=None):
+        """期間内の決済済みトレード（決済時刻順）。start/end は datetime かミリ秒"""
+        if symbol is None:
+            rows, times = self.close_rows, self.close_times
+        else:
+            i = np.searchsorted(self.symbols, symbol.encode())
+            if i == len(self.symbols) or self.symbols[i] != symbol.encode():
+                return np.zeros(0, dtype=JOURNAL_DTYPE)
+            stop = self.symbol_starts[i + 1] if i + 1 < len(self.symbols) else len(self.symbol_rows)
+            rows = self.symbol_rows[self.symbol_starts[i]:stop]
+            times = self.records['event_ms'][rows]
+        lo = 0 if start is None else np.searchsorted(times, _to_ms(start), side='left')
+        hi = len(rows) if end is None else np.searchsorted(times, _to_ms(end), side='right')
+        return self.records[rows[lo:hi]]
+
+    def stats(self, symbol=None, start=None, end=None):
+        """勝率・PnL・平均保有時間・最大ドローダウン（累積PnLの高値からの下落、USDT）"""
+        return summarize(self.trades(symbol, start, end))
+
+    def stats_by_symbol(self, start=None, end=None):
+        return {symbol.decode(): self.stats(symbol.decode(), start, end) for symbol in self.symbols}
+
+def summarize(trades):
+    """PnL が求まらないトレード（決済価格不明など）は集計から外し、件数を skipped に入れる"""
+    valid = np.isfinite(trades['pnl'])
+    skipped = int((~valid).sum())
+    trades = trades[valid]
+    pnl = trades['pnl']
+    if len(pnl) == 0:
+        return {'trades': 0, 'win_rate': np.nan, 'total_pnl': 0.0, 'avg_pnl': np.nan, 'avg_holding_hours': np.nan, 'max_drawdown': 0.0, 'skipped': skipped}
+    equity = np.concatenate([[0.0], np.cumsum(pnl)])
+    holding = (trades['exit_ms'] - trades['entry_ms'])[trades['entry_ms'] > 0] / 3600 / 1000
+    return {
+        'trades': len(pnl),
+        'win_rate': float((pnl > 0).mean()),
+        'total_pnl': float(pnl.sum()),
+        'avg_pnl': float(pnl.mean()),
+        'avg_holding_hours': float(holding.mean()) if len(holding) else np.nan,
+        'max_drawdown': float((np.maximum.accumulate(equity) - equity).max()),
+        'skipped': skipped,
+    }
+
+if __name__ == '__main__':
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    journal = TradeJournal(sys.argv[2] if len(sys.argv) > 2 else journal_file)
+    start = int(time.time() * 1000 - days * 86400 * 1000) if days else None
+
+    print(f"{'銘柄':<10} {'件数':>5} {'勝率':>6} {'合計PnL':>10} {'平均PnL':>9} {'保有(h)':>8} {'最大DD':>9} {'除外':>4}")
+    rows = list(journal.stats_by_symbol(start).items()) + [('合計', journal.stats(start=start))]
+    for symbol, s in rows:
+        print(f"{symbol:<10} {s['trades']:>5} {s['win_rate']:>6.1%} {s['total_pnl']:>10.2f} {s['avg_pnl']:>9.3f} "
+              f"{s['avg_holding_hours']:>8.1f} {s['max_drawdown']:>9.2f} {s['skipped']:>4}")
@@ -0,0 +1,166 @@
+"""
+cron起動間のウォームスタート用スナップショット
+- 確定足のOHLCV末尾・ADXの途中状態・検出済みフラクタル・銘柄情報を npz で保存
+- 次回起動時は読み込んで新しい足だけ処理する
+- バージョン違い・銘柄設定違い・古すぎるスナップショットは破棄
+"""
+
+import io
+import os
+import math
+from pathlib import Path
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = Path('snapshots')
+MAX_GAP_BARS = 200  # これ以上足が空いたらスナップショットを使わず全件取得
+
+# bars の列順（Bybit kline のレスポンスと同じ）
+BAR_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "quote_volume"]
+
+class _Rma:
+    """pandas の ewm(alpha=1/length, min_periods=length, adjust=True) を1本ずつ更新"""
+    def __init__(self, length, num=0.0, den=0.0, count=0):
+        self.length = length
+        self.decay = 1.0 - 1.0 / length
+        self.num = num
+        self.den = den
+        self.count = count
+
+    def update(self, x):
+        valid = not math.isnan(x)
+        self.num = self.num * self.decay + (x if valid else 0.0)
+        self.den = self.den * self.decay + (1.0 if valid else 0.0)
+        self.count += valid
+        return self.num / self.den if self.count >= self.length else math.nan
+
+class IncrementalADX:
+    """pandas_ta.adx（mamode=rma）と同じ計算を1本ずつ進めるADX"""
+    def __init__(self, length=14):
+        self.length = length
+        self.prev = None  # (high, low, close)
+        self.tr = _Rma(length)
+        self.pos = _Rma(length)
+        self.neg = _Rma(length)
+        self.dx = _Rma(length)
+
+    def update(self, high, low, close):
+        if self.prev is None:
+            tr = up = dn = math.nan
+        else:
+            prev_high, prev_low, prev_close = self.prev
+            tr = max(high - low, abs(high - prev_close), abs(prev_close - low))
+            up = high - prev_high
+            dn = prev_low - low
+        self.prev = (high, low, close)
+
+        pos = up if (up > dn and up > 0) else (math.nan if math.isnan(up) else 0.0)
+        neg = dn if (dn > up and dn > 0) else (math.nan if math.isnan(dn) else 0.0)
+
+        # DMP/DMN は同じATRで割るので DX では打ち消し合う（ATRはNaN判定にのみ使用）
+        atr = self.tr.update(tr)
+        pos_rma = self.pos.update(pos)
+        neg_rma = self.neg.update(neg)
+        total = pos_rma + neg_rma
+        if math.isnan(atr) or atr == 0 or math.isnan(total) or total == 0:
+            dx = math.nan
+        else:
+            dx = 100 * abs(pos_rma - neg_rma) / total
+        return self.dx.update(dx)
+
+    def copy(self):
+        return IncrementalADX.from_array(self.to_array(), self.length)
+
+    def to_array(self):
+        prev = self.prev if self.prev is not None else (math.nan, math.nan, math.nan)
+        rmas = [self.tr, self.pos, self.neg, self.dx]
+        return np.array([*prev] + [v for r in rmas for v in (r.num, r.den, r.count)], dtype=np.float64)
+
+    @classmethod
+    def from_array(cls, arr, length=14):
+        adx = cls(length)
+        adx.prev = None if math.isnan(arr[0]) else (float(arr[0]), float(arr[1]), float(arr[2]))
+        for i, r in enumerate([adx.tr, adx.pos, adx.neg, adx.dx]):
+            r.num, r.den, r.count = float(arr[3 + i * 3]), float(arr[4 + i * 3]), int(arr[5 + i * 3])
+        return adx
+
+def dual_fractal_indices(high, low, start=2):
+    """start 以降でデュアルフラクタル（前後2本より高値が高く安値が安い）になる足のインデックス"""
+    n = len(high)
+    start = max(start, 2)
+    if n - start < 3:
+        return np.array([], dtype=np.int64)
+    i = np.arange(start, n - 2)
+    is_high = (high[i] > high[i - 2]) & (high[i] > high[i - 1]) & (high[i] > high[i + 1]) & (high[i] > high[i + 2])
+    is_low = (low[i] < low[i - 2]) & (low[i] < low[i - 1]) & (low[i] < low[i + 1]) & (low[i] < low[i + 2])
+    return i[is_high & is_low]
+
+def snapshot_path(symbol, interval):
+    return SNAPSHOT_DIR / f"{symbol}_{interval}.npz"
+
+def atomic_savez(path, **arrays):
+    """npz を保存（書き込み途中で読まれないよう一時ファイル経由）"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(buf.getvalue())
+    os.replace(tmp_path, path)
+
+def save_snapshot(symbol, interval, meta, bars, adx, adx_state, fractal_ms):
+    """確定足のみのスナップショットを保存"""
+    atomic_savez(
+        snapshot_path(symbol, interval),
+        version=np.int64(SNAPSHOT_VERSION),
+        symbol=np.str_(symbol),
+        interval=np.str_(interval),
+        meta=np.asarray(meta, dtype=np.float64),
+        bars=np.asarray(bars, dtype=np.float64),
+        adx=np.asarray(adx, dtype=np.float64),
+        adx_state=adx_state.to_array(),
+        adx_length=np.int64(adx_state.length),
+        fractal_ms=np.asarray(fractal_ms, dtype=np.int64),
+    )
+
+def load_snapshot(symbol, interval, meta, adx_length, now_ms):
+    """スナップショットを読み込み。使えない場合は None"""
+    path = snapshot_path(symbol, interval)
+    if not path.exists():
+        return None
+
+    try:
+        with np.load(path) as data:
+            snapshot = {key: data[key] for key in data.files}
+    except Exception as e:
+        print(f"⚠️ {symbol} スナップショット読み込み失敗: {str(e)}")
+        return None
+
+    # 互換性チェック
+    if (int(snapshot.get('version', -1)) != SNAPSHOT_VERSION
+            or str(snapshot['symbol']) != symbol
+            or str(snapshot['interval']) != interval
+            or int(snapshot['adx_length']) != adx_length
+            or not np.array_equal(snapshot['meta'], np.asarray(meta, dtype=np.float64))):
+        print(f"⚠️ {symbol} スナップショットの形式が一致しないため破棄")
+        return None
+
+    bars = snapshot['bars']
+    interval_ms = int(interval) * 60 * 1000
+    if bars.ndim != 2 or bars.shape[1] != len(BAR_COLUMNS) or len(bars) < 5 or len(snapshot['adx']) != len(bars):
+        print(f"⚠️ {symbol} スナップショットが壊れているため破棄")
+        return None
+    if not np.all(np.diff(bars[:, 0]) == interval_ms):
+        print(f"⚠️ {symbol} スナップショットの足が連続していないため破棄")
+        return None
+
+    # 鮮度チェック（最後の確定足から何本進んだか）
+    gap_bars = (now_ms - int(bars[-1, 0])) // interval_ms
+    if gap_bars < 1 or gap_bars > MAX_GAP_BARS:
+        print(f"⚠️ {symbol} スナップショットが古いため破棄（{gap_bars}本）")
+        return None
+
+    snapshot['gap_bars'] = int(gap_bars)
+    snapshot['adx_state'] = IncrementalADX.from_array(snapshot['adx_state'], adx_length)
+    return snapshot